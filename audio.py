@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+import collections
+
+import numpy
+import pygame
+
+from cache import cached_file
+
+# Audio analysis for the music mode.  A background thread grabs the most
+# recent WINDOW samples of whatever is playing every HOP_TIME seconds, runs an
+# FFT on them and splits it up into a few bands.  It also looks for beats
+# (sudden jumps in the bass).
+#
+# The results get published as a new AudioLevels tuple each time so the
+# animation just reads analyzer.levels whenever it likes.  No locks, the
+# worst that can happen is getting the previous set.
+WINDOW = 1024
+HOP_TIME = 0.01
+
+# Analysis is done at a quarter of the mixer rate (~11 kHz), plenty for
+# bass/mid/treble and it keeps the FFT cheap on a Pi.
+DECIMATE = 4
+
+# Band edges in Hz.  Bass, low mid, mid, high mid, presence.
+BAND_EDGES = (30, 150, 400, 1000, 2500, 5000)
+
+# Each band is scaled by its recent peak so quiet and loud songs both use
+# the whole range.  The peak falls by this much every hop.
+PEAK_DECAY = 0.998
+PEAK_FLOOR = 1e-4
+
+# A beat is when the rise in the bass is this many standard deviations over
+# its average for the last ONSET_WINDOW hops.  No more than one every
+# ONSET_GAP seconds.
+ONSET_WINDOW = 50
+ONSET_THRESHOLD = 2.0
+ONSET_GAP = 0.15
+
+# How much of a capture device to keep around (samples)
+CAPTURE_SIZE = 8192
+
+# bands: 0..1 for each band, beats: number of beats so far, time: when it
+# was worked out (time.monotonic())
+AudioLevels = collections.namedtuple('AudioLevels', 'bands beats time')
+SILENCE = AudioLevels(numpy.zeros(len(BAND_EDGES) - 1), 0, 0.0)
+
+def mixer_rate():
+    init = pygame.mixer.get_init()
+    return init[0] if init else 44100
+
+# Decodes a sound file into mono int16 at the analysis rate, written to out
+# (an open file).  The background loops are over an hour long, which is the
+# best part of a GB decoded at the mixer's rate in stereo, and
+# pygame.mixer.Sound() can only decode a whole file at once.  So it's done by
+# this file run as a script (see the bottom), with its own mixer at the
+# analysis rate in mono.  SDL converts as it decodes and the full rate copy
+# never exists anywhere.  The script's output goes straight into out, this
+# process never holds any of it.
+def decode(path, rate, out):
+    env = dict(os.environ, SDL_AUDIODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), path, str(rate)],
+                            env=env, stdout=out, stderr=subprocess.PIPE)
+    if result.returncode:
+        errors = result.stderr.decode(errors='replace').strip().splitlines()
+        raise OSError(errors[-1] if errors else f"decoding failed ({result.returncode})")
+
+# Follows pygame.mixer.music through a decoded copy of the same file (there's
+# no way to get at what pygame's mixer actually plays).  Decoding happens on
+# the analyzer thread the first time each file is needed and is cached on
+# disk (see cache.py), so after that it's a memory map.  Only the track that
+# is playing is kept.
+class FileSource:
+    def __init__(self, decimate=DECIMATE):
+        self.decimate = decimate
+        self.rate = mixer_rate() // decimate
+        self.track = None   # (path, samples)
+        self.path = None
+
+    def follow(self, path):
+        if path != self.path:
+            self.path = path
+            self.track = None
+
+    def load(self, path):
+        stat = os.stat(path)
+        key = dict(path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns, rate=self.rate)
+        return cached_file('music', key, lambda f: decode(path, self.rate, f), ext='.pcm').view(numpy.int16)
+
+    # The last size samples up to where the music is now, or None
+    def window(self, size):
+        path = self.path
+        if path is None:
+            return None
+        track = self.track
+        if track is None or track[0] != path:
+            try:
+                track = (path, self.load(path))
+            except (pygame.error, OSError) as e:
+                print(f"Can't analyze {path}: {e}", flush=True)
+                track = (path, None)
+            self.track = track
+        samples = track[1]
+        pos = pygame.mixer.music.get_pos()
+        if samples is None or len(samples) < size or pos < 0:
+            return None
+
+        end = int(pos / 1000 * self.rate) % len(samples)
+        window = samples.take(numpy.arange(end - size, end), mode='wrap')
+        return window.astype(numpy.float32) / 32768
+
+# Records from an SDL capture device.  Point it at a loopback (or PulseAudio
+# "Monitor of ...") device to hear exactly what the ship is playing.
+class CaptureSource:
+    def __init__(self, device=None, decimate=DECIMATE, size=CAPTURE_SIZE):
+        from pygame._sdl2 import audio as sdl_audio
+
+        self.decimate = decimate
+        self.rate = mixer_rate() / decimate
+        self.ring = numpy.zeros(size, dtype=numpy.float32)
+        self.written = 0
+        self.device = sdl_audio.AudioDevice(devicename=device, iscapture=True,
+                                            frequency=mixer_rate(), audioformat=sdl_audio.AUDIO_F32,
+                                            numchannels=1, chunksize=512, allowed_changes=0,
+                                            callback=self.callback)
+        self.device.pause(0)
+
+    # Runs on SDL's audio thread.  Only ever written from here so no lock.
+    def callback(self, device, data):
+        samples = numpy.frombuffer(data, dtype=numpy.float32)
+        samples = samples[:len(samples) - len(samples) % self.decimate]
+        samples = samples.reshape(-1, self.decimate).mean(axis=1)
+        ix = numpy.arange(self.written, self.written + len(samples)) % len(self.ring)
+        self.ring[ix] = samples
+        self.written += len(samples)
+
+    # Hears whatever is playing anyway
+    def follow(self, path):
+        pass
+
+    def window(self, size):
+        end = self.written
+        if end < size:
+            return None
+        return self.ring.take(numpy.arange(end - size, end), mode='wrap')
+
+    def close(self):
+        self.device.close()
+
+class AudioAnalyzer(threading.Thread):
+    def __init__(self, source, window=WINDOW, hop=HOP_TIME):
+        super().__init__(daemon=True)
+        self.source = source
+        self.size = window
+        self.hop = hop
+        self.running = True
+        self.levels = SILENCE
+
+        # Only analyses while this is set (see resume() and pause()), the
+        # rest of the time the thread just waits on it.
+        self.active = threading.Event()
+
+        # Which band each FFT bin goes in (bins outside all of them are
+        # dropped).
+        freqs = numpy.fft.rfftfreq(window, 1 / source.rate)
+        bands = numpy.digitize(freqs, BAND_EDGES) - 1
+        self.used = (bands >= 0) & (bands < len(BAND_EDGES) - 1)
+        self.bands = bands[self.used]
+        self.band_count = len(BAND_EDGES) - 1
+        self.taper = numpy.hanning(window).astype(numpy.float32)
+
+        self.peaks = numpy.full(self.band_count, PEAK_FLOOR)
+        self.last = numpy.zeros(self.band_count)
+        self.flux = collections.deque(maxlen=ONSET_WINDOW)
+        self.beats = 0
+        self.last_beat = 0.0
+
+        # How long an analysis takes (seconds, smoothed) for the stats
+        self.busy = 0.0
+
+    def analyze(self, samples, now):
+        spectrum = numpy.fft.rfft(samples * self.taper)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2)[self.used]
+        energy = numpy.log1p(numpy.bincount(self.bands, weights=power, minlength=self.band_count))
+
+        self.peaks = numpy.maximum(self.peaks * PEAK_DECAY, energy)
+        bands = energy / self.peaks
+
+        # Beats: the bass going up a lot more than it usually does
+        flux = max(0.0, energy[0] - self.last[0])
+        self.last = energy
+        if len(self.flux) == self.flux.maxlen and now - self.last_beat > ONSET_GAP:
+            history = numpy.array(self.flux)
+            if flux > history.mean() + ONSET_THRESHOLD * history.std():
+                self.beats += 1
+                self.last_beat = now
+        self.flux.append(flux)
+        return bands
+
+    def run(self):
+        deadline = time.monotonic()
+        while self.running:
+            if not self.active.is_set():
+                self.levels = AudioLevels(SILENCE.bands, self.beats, time.monotonic())
+                self.active.wait()
+                deadline = time.monotonic()
+                continue
+
+            start = time.monotonic()
+            samples = self.source.window(self.size)
+            if samples is None:
+                self.levels = AudioLevels(SILENCE.bands, self.beats, start)
+            else:
+                self.levels = AudioLevels(self.analyze(samples, start), self.beats, start)
+            done = time.monotonic()
+            self.busy += 0.05 * ((done - start) - self.busy)
+
+            deadline = max(deadline + self.hop, done)
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+    # Starts the thread the first time
+    def resume(self):
+        self.active.set()
+        if self.ident is None:
+            self.start()
+
+    def pause(self):
+        self.active.clear()
+
+    def stop(self):
+        self.running = False
+        self.active.set()
+
+    def report(self):
+        return f"audio {self.busy * 1000:0.2f} ms, {self.beats} beats"
+
+# python audio.py SOUND RATE writes SOUND to stdout as raw mono int16 at RATE.
+# Only used by decode().
+if __name__ == '__main__':
+    rate = int(sys.argv[2])
+    pygame.mixer.init(frequency=rate, size=-16, channels=1)
+    if pygame.mixer.get_init() != (rate, -16, 1):
+        sys.exit(f"Mixer is {pygame.mixer.get_init()}, wanted ({rate}, -16, 1)")
+    sys.stdout.buffer.write(memoryview(pygame.mixer.Sound(sys.argv[1])))
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+
+import numpy
+
+import boat
+import effects
+from color import ColorPipeline
+from output import OpcWriter
+
+# Frames run (and thrown away) before timing anything
+WARMUP_FRAMES = 10
+
+# The allocation pass runs under tracemalloc which is slow so it only does a
+# few frames.
+ALLOC_FRAMES = 100
+
+STAGES = ('update', 'pack', 'serialize', 'send')
+
+# Stands in for the Fadecandy socket.  The packet still goes through a real
+# write() system call, it just ends up in /dev/null.
+class NullSocket:
+    def __init__(self):
+        self.fd = os.open(os.devnull, os.O_WRONLY)
+
+    def sendall(self, data):
+        os.write(self.fd, data)
+
+    def close(self):
+        os.close(self.fd)
+
+# The same stages main() runs each frame, minus the display and the network.
+# With fade_from set it is stuck half way through a cross-fade from that mode
+# (a fade that takes forever, started from the middle) so every frame draws
+# both and blends them 50/50.
+class Pipeline:
+    def __init__(self, mode, freq, seed=None, fade_from=None):
+        boat_seed, _ = boat.split_seed(seed)
+        self.boat = boat.Boat(nacelle_freq=freq, seed=boat_seed)
+        if fade_from:
+            self.boat.mode = fade_from
+            self.boat.transition_time = 1e9
+        self.boat.mode = mode
+        if fade_from:
+            self.boat.fade_elapsed = self.boat.transition_time / 2
+        self.dt = 1000 / boat.mode_rate(mode)
+
+        self.colors = ColorPipeline(self.boat.strand_sizes, boat.STRAND_LENGTH)
+        self.writer = OpcWriter('localhost:0', len(self.boat.frame))
+        self.writer.socket = NullSocket()
+
+    def frame(self, times=None):
+        clock = time.perf_counter_ns
+
+        start = clock()
+        self.boat.update(self.dt)
+        updated = clock()
+        frame = self.boat.strands
+        packed = clock()
+        numpy.copyto(self.writer.frame, self.colors.apply(frame))
+        serialized = clock()
+        self.writer.send()
+        sent = clock()
+
+        if times is not None:
+            times.append((updated - start, packed - updated, serialized - packed, sent - serialized))
+
+    def close(self):
+        self.writer.disconnect()
+
+def summarize(ns):
+    us = numpy.asarray(ns) / 1000
+    return {'mean_us': round(float(us.mean()), 2),
+            'p50_us': round(float(numpy.percentile(us, 50)), 2),
+            'p99_us': round(float(numpy.percentile(us, 99)), 2),
+            'max_us': round(float(us.max()), 2),
+           }
+
+# Bytes allocated (and released again) and blocks left behind per frame
+def measure_allocations(pipeline, frames):
+    tracemalloc.start()
+    peaks = []
+    blocks = sys.getallocatedblocks()
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        pipeline.frame()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    return {'peak_bytes_per_frame': round(float(numpy.mean(peaks)), 1),
+            'net_blocks_per_frame': round(blocks / frames, 2),
+           }
+
+def bench_mode(mode, frames, freq, seed=None, fade_from=None):
+    pipeline = Pipeline(mode, freq, seed, fade_from)
+    for _ in range(WARMUP_FRAMES):
+        pipeline.frame()
+
+    times = []
+    for _ in range(frames):
+        pipeline.frame(times)
+    times = numpy.array(times)
+
+    result = {'target_fps': boat.mode_rate(mode),
+              'budget_us': round(1e6 / boat.mode_rate(mode), 2),
+              'stages': {stage: summarize(times[:, ix]) for ix, stage in enumerate(STAGES)},
+              'total': summarize(times.sum(axis=1)),
+              'allocations': measure_allocations(pipeline, min(frames, ALLOC_FRAMES)),
+             }
+    pipeline.close()
+    return result
+
+# Which Pi (or whatever) this is, so results from different boxes can be
+# told apart.
+def machine_info():
+    info = {'machine': platform.machine(),
+            'system': platform.system(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+           }
+    try:
+        with open('/proc/device-tree/model') as f:
+            info['model'] = f.read().strip('\0\n')
+    except OSError:
+        pass
+    return info
+
+def run(args):
+    results = {'machine': machine_info(),
+               'frames': args.frames,
+               'seed': args.seed,
+               'modes': dict(),
+               'fades': dict(),
+              }
+    for mode in effects.REGISTRY:
+        print(f"Benchmarking {mode!r}...", file=sys.stderr, flush=True)
+        results['modes'][mode] = bench_mode(mode, args.frames, args.freq, args.seed)
+
+    # Cross-fading into each mode from the default one.  This is as bad as
+    # a frame gets so it has to fit in the budget too.  Modes that are the
+    # same effect as the default one don't fade at all so they're left out.
+    for mode in effects.REGISTRY:
+        if effects.REGISTRY[mode] is effects.REGISTRY[boat.DEFAULT_MODE]:
+            continue
+        print(f"Benchmarking {boat.DEFAULT_MODE!r} -> {mode!r}...", file=sys.stderr, flush=True)
+        results['fades'][mode] = bench_mode(mode, args.frames, args.freq, args.seed, boat.DEFAULT_MODE)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
@@ -1,19 +1,33 @@
 import sys
 import os
-import math
-import random
 import argparse
 import time
 import glob
+import signal
+import types
 
 # TODO: Look at migrating this to pygame-ce
+# pygame's hello message would end up in the middle of the --bench JSON
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
 import pygame
-import opc
 
 import numpy
 
 from pprint import pprint
 
+import audio
+import effects
+import keypad
+from cache import cached_arrays
+from color import ColorPipeline
+from compositor import Compositor
+from geometry import LAYOUT, STRAND_COUNT, STRAND_LENGTH, RAIL_SIZE, KITT_SIZE, WAVE_SIZE, SPINNER_SIZE, TAIL_SIZE
+from output import FanOut, OpcWriter, KEEPALIVE_TIME
+from power import PowerMonitor
+from recording import Recorder, Recording, FORMATS as RECORD_FORMATS
+from sounds import SoundBank, SoundScheduler, sound_files
+from timing import FrameClock, StageTimer
+
 FADECANDY_HOST = 'localhost'
 FADECANDY_PORT = 7890
 TEMPORAL_DITHERING = True
@@ -42,6 +56,14 @@ MODES = {pygame.K_KP1: 'boat',
          pygame.K_0: 'america',
          pygame.K_BACKQUOTE: 'space',
         }
+# Effects can ask for keys of their own (as long as they aren't taken)
+def add_effect_keys():
+    for name, effect in effects.REGISTRY.items():
+        for key in effect.keys:
+            MODES.setdefault(key, name)
+
+add_effect_keys()
+
 SFX_KEYS = {'w': 'warp',
             'p': 'plaid',
             't': 'theme',
@@ -52,6 +74,34 @@ SFX_KEYS = {'w': 'warp',
             'f': 'fire'
            }
 SFX_CHANNELS = {'warp': 0, 'fire': 1, 'alert': 2, 'general': 4}
+
+# Channel and priority for the one-shot sound effects.  A higher priority
+# sound cuts off a lower one (fading it out over SFX_CROSSFADE ms), the same
+# or lower waits until the channel is free.
+SFX_PRIORITIES = {'alarm': ('general', 2),
+                  'comms': ('general', 1),
+                  'whistle': ('general', 1),
+                  'theme': ('general', 0),
+                  'fire': ('fire', 0),
+                 }
+SFX_CROSSFADE = 500
+
+# The background music gets turned down while these are playing
+SFX_DUCKING = ('warp',)
+
+# Going into and out of warp.  (state, key) -> (warp sound, fade, new state).
+# The sound cross-fades in over fade ms, or waits for the one that's playing
+# to finish if fade is None.  No sound means stop, fading out over fade ms.
+# The state goes back to None whenever the warp channel runs out of sounds.
+WARP_STATES = {(None, 'warp'): ('long', 0, 'long'),
+               ('long', 'warp'): ('exit', 500, 'exit'),
+               ('exit', 'warp'): ('long', None, 'long'),
+               ('plaid', 'warp'): ('long', 1000, 'long'),
+               (None, 'plaid'): ('plaid', 0, 'plaid'),
+               ('long', 'plaid'): ('plaid', 1000, 'plaid'),
+               ('exit', 'plaid'): ('plaid', None, 'plaid'),
+               ('plaid', 'plaid'): (None, 1000, None),
+              }
 DEFAULT_MODE = 'space'
 
 # IMPORTANT: As noted, a lot of the debugging (and actual coding) was done
@@ -60,28 +110,43 @@ DEFAULT_MODE = 'space'
 #            this on the fact that my config.json file got corrupted so I
 #            just reverted to padding each strand in software.  Sorry, this
 #            is not the best example of how to configure a FadeCandy.
-
-# This is the number of LEDs in each element of the boat. Doesn't directly
-# map to the LED positions on the fade candy.
-RAIL_SIZE = 120
-KITT_SIZE = 20
-STERN_SIZE = 15
-NOSE_SIZE = 30
-WAVE_SIZE = 30
-PROW = RAIL_SIZE - NOSE_SIZE
-SPINNER_SIZE = 16
-TAIL_SIZE = 8
+#
+#            These days the strand padding (and where everything is) comes
+#            from layout.json, see geometry.py.
+
+# The waves and nacelles are looked up from precomputed tables rather than
+# worked out every frame.  This is how many steps one trip around the wave
+# gets chopped into.  The nacelles are exact to the half degree (720 steps),
+# which is as fine as the 16 spinner LEDs can tell apart.
+WAVE_PHASES = 4096
+WAVE_STEP = 0.31
+NACELLE_PHASES = 720
+
+# How many frames' worth of random speckles to draw at once
+SPECKLE_BLOCK = 1024
+
+# Overlays drawn on top of the modes (bottom first) as (name, blend, opacity).
+# See compositor.py for the blends.
+LAYERS = (('nav_lights', 'alpha', 1.0),
+          ('warp', 'add', 1.0),
+          ('red_alert', 'alpha', 0.8),
+         )
+
+# Overlays that come and go with the mode rather than with a sound effect
+MODE_LAYERS = ('nav_lights',)
+
+# How long (in seconds) switching modes cross-fades from the old one to the
+# new one.  Both modes get drawn every frame until it's done.
+FADE_MODES = 1.0
+
+# Current budgets (mA) for each strand when limiting is turned on (--limit).
+# Roughly the old guesses for the strands and the nacelles get what the poop
+# deck used to.
+STRAND_BUDGETS = (600, 480, 600, 480, 850, 350, 350, None)
 
 # Note: Removed the poop deck lighting when they caught on fire a bit.
 #       Also removed the ground effect when we redid the decking.  May add these back.
 
-# The spinners are for the warp nacelles.
-SPINNER_X = 550
-SPINNER_TOP = 200
-SPINNER_BOT = 350
-
-TAIL_X = 350
-
 OFF = [(0, 0, 0)] * 64
 
 # For display purposes.  The size of each LED in pixels and the space between LEDs
@@ -89,6 +154,7 @@ LED_SIZE = 8
 LED_GAP  = 2
 
 # Cheap way of controlling the animation speed.  We just change the frame rate.
+# These are targets for the FrameClock in frames per second.
 RATES = dict(boat=20, 
              fast_boat=60, 
              speed_boat=120,
@@ -102,6 +168,22 @@ RATES = dict(boat=20,
              space=20,
             )
 
+# Modes from plugins that aren't in RATES run at whatever rate the effect asks for
+def mode_rate(mode):
+    return RATES.get(mode, effects.REGISTRY[mode].rate)
+
+# Separate random streams for the lights and the sounds so pressing a key
+# doesn't change what the lights do.  Everything that makes a Boat (live,
+# --render and --bench) gets its seed from here so the same --seed gives the
+# same show.  The entropy of either one is the seed to repeat it.
+def split_seed(seed=None):
+    boat_seed, sfx_seed = numpy.random.SeedSequence(seed).spawn(2)
+    return boat_seed, sfx_seed
+
+# The LEDs are pushed from their own thread at a fixed rate.  This is fast
+# enough to keep up with the fastest animation.
+OUTPUT_RATE = max(RATES.values())
+
 # How much the brightness is increased or decreased each step
 BRIGHT_STEP = 0.1
 
@@ -112,17 +194,18 @@ SPACE_MUSIC = './space_background.mp3'
 SFX_DIR = './sfx'
 FADE_TIME = 1000
 
-# This is a single LED object.  If I were to start fresh, I might not
-# do it this way but this let me develop/debug the boat and get it into
-# a working state.
-class Led:
-    def __init__(self, pos, size, color=(0,0,0)):
-        self.color = color
-        self.rect = pygame.Rect(pos, size)
+# How often (in seconds) to print the frame rate stats in verbose mode.
+STATS_INTERVAL = 10
+
+# The performance overlay (press 'i') sits in the empty bit of the screen
+# between the stern and the nacelles.  It is only redrawn a few times a second.
+OVERLAY_RECT = (20, 140, 320, 320)
+OVERLAY_FONT_SIZE = 18
+OVERLAY_COLOR = (0, 255, 0)
+OVERLAY_INTERVAL = 0.25
 
-    def draw(self, surf, scale=1.0):
-        color = [int(c * scale) for c in self.color]
-        pygame.draw.rect(surf, color, self.rect)
+# Parts of the main loop that get timed
+LOOP_STAGES = ('events', 'wait', 'update', 'draw', 'flip', 'output')
 
 # Contains all of the LED strand animation routines.
 class Boat:
@@ -149,39 +232,117 @@ class Boat:
     # poop_decay = 15
     # poop_fires = 3
 
-    def __init__(self, nacelle_freq=1.0, verbose=False):
-        self.wave_left  = generate_waves(self.wave_level, True)
-        self.wave_right = generate_waves(self.wave_level, False)
-        self.rail_left  = generate_rail(self.rail_level, True)
-        self.rail_right = generate_rail(self.rail_level, False)
-        self.kitt = generate_kitt(self.kitt_dark)
-        self.nacelle_left = generate_nacelle(self.nacelle_level, True)
-        self.nacelle_right = generate_nacelle(self.nacelle_level, False)
-
-        self.strips = (self.wave_left,
-                       self.wave_right,
-                       self.rail_left,
-                       self.rail_right,
-                       self.kitt,
-                       self.nacelle_left,
-                       self.nacelle_right,
-                      )
-
-        self.kitt_pos = 0
-        self.kitt_dir = 1
-
-        self.wave_offset = 0.0
-
-        self._mode = DEFAULT_MODE
-        self.brightness = 1.0
+    def __init__(self, nacelle_freq=1.0, verbose=False, seed=None, transition_time=0.0):
+        layout = LAYOUT
+
+        # There used to be an Led object (with a pygame.Rect) for every LED.
+        # Now the simulator just has arrays: each LED's rect on the screen
+        # and, for clicking on them, a grid of which LED is in each spot.
+        self.rects = layout.rects(LED_SIZE, LED_GAP)
+        self.grid = numpy.full(layout.screen, -1, dtype=numpy.int32)
+        self.grid[tuple(layout.positions.T)] = numpy.arange(layout.size)
+
+        # Where in an LED's rect each screen pixel is, for draw()
+        dot = numpy.arange(LED_SIZE)
+        self._dot_x = dot[None, :, None]
+        self._dot_y = dot[None, None, :]
+
+        # One contiguous frame buffer for the whole ship.  Each strip is a
+        # named view into it so the animations can work on whole strips
+        # (or the whole ship) at once instead of poking LEDs one at a time.
+        #
+        # There is one extra row on the end that is never animated and always
+        # stays black.  The strand padding points at it.
+        self._buffer = numpy.zeros((layout.size + 1, 3), dtype=numpy.uint8)
+        self.pixels = self._buffer[:layout.size]
+
+        self.offsets = dict(layout.strips)
+        for name, (start, end) in self.offsets.items():
+            setattr(self, name, self.pixels[start:end])
+
+        self.strips = tuple(getattr(self, name) for name in self.offsets)
+
+        # What everything starts out as
+        self.wave_left[:] = (0, 0, self.wave_level)
+        self.wave_right[:] = (0, 0, self.wave_level)
+        self.rail_left[:] = self.rail_level
+        self.rail_right[:] = self.rail_level
+        self.kitt[:] = self.kitt_dark
+        self.nacelle_left[:] = (self.nacelle_level, self.nacelle_level // 4, 0)
+        self.nacelle_right[:] = (self.nacelle_level, self.nacelle_level // 4, 0)
+
+        # Both wave strips sit next to each other in the frame buffer, so do
+        # both rails.
+        assert self.offsets['wave_left'][1] == self.offsets['wave_right'][0]
+        assert self.offsets['rail_left'][1] == self.offsets['rail_right'][0]
+        self.groups = dict(waves=(self.offsets['wave_left'][0], self.offsets['wave_right'][1]),
+                           rails=(self.offsets['rail_left'][0], self.offsets['rail_right'][1]))
+        self.waves = self.pixels[slice(*self.groups['waves'])]
+        self.rails = self.pixels[slice(*self.groups['rails'])]
+
+        # The physical layout never changes so work out once where every
+        # FadeCandy pixel comes from and just gather it each frame.
+        self.strand_map = layout.strand_map
+        self.strand_sizes = (self.strand_map.reshape(STRAND_COUNT, STRAND_LENGTH) != len(self.pixels)).sum(axis=1)
+        self.frame = numpy.zeros((STRAND_COUNT * STRAND_LENGTH, 3), dtype=numpy.uint8)
+
+        # What the simulator last drew for each LED (-1 is nothing yet)
+        self._drawn = numpy.full(self.pixels.shape, -1, dtype=numpy.int16)
 
-        self.disco_delay = 0
+        self.brightness = 1.0
         self.verbose = verbose
 
+        # Seconds since the boat started
+        self.time = 0.0
+
+        # What the music mode listens to (an audio.AudioAnalyzer), if anything
+        self.audio = None
+
+        # All of the random effects come from here.  Give it a seed and you
+        # get the same show every time.  The overlays get a stream of their
+        # own (a child of the same seed) so turning warp on and off doesn't
+        # change what the modes do.
+        if not isinstance(seed, numpy.random.SeedSequence):
+            seed = numpy.random.SeedSequence(seed)
+        self.rng = numpy.random.default_rng(seed)
+        self.overlay_rng = numpy.random.default_rng(seed.spawn(1)[0])
+
         self.spin_rate = 360 / numpy.pi
-        self.nacelle_angles = numpy.linspace(0, 360, SPINNER_SIZE + 1)[:-1]
-        self.nacelle_brightness = (numpy.sin(numpy.arange(360) * nacelle_freq / (2 * numpy.pi)) + 1) * 0.5
-        self.nacelle_brightness *= 255 - self.nacelle_level
+        self.nacelle_angle = 0.0
+
+        key = dict(wave_size=WAVE_SIZE, wave_level=self.wave_level, wave_phases=WAVE_PHASES,
+                   spinner_size=SPINNER_SIZE, tail_size=TAIL_SIZE, nacelle_level=self.nacelle_level,
+                   nacelle_freq=nacelle_freq, nacelle_phases=NACELLE_PHASES)
+        tables = cached_arrays('tables', key, lambda: dict(
+            waves=generate_wave_table(self.wave_level),
+            nacelles=generate_nacelle_table(self.nacelle_level, nacelle_freq)))
+        self.wave_table = tables['waves']
+        self.nacelle_table = tables['nacelles']
+
+        # Overlays.  What actually goes out (and on the screen) is _shown,
+        # which is either _buffer or the composited copy of it.
+        self.layers = Compositor(len(self.pixels))
+        for name, blend, opacity in LAYERS:
+            self.layers.add(name, effects.create(name, self, effects.OVERLAYS), blend, opacity)
+        self._shown = self._buffer
+
+        # Cross-fades.  While one is going the old effect keeps drawing into
+        # _fade_from and gets blended with the new one into _faded.  Same
+        # layout as _buffer including the black row.
+        self.transition_time = transition_time
+        self.fading = None
+        self.fade_elapsed = 0.0
+        self._fade_from = numpy.zeros_like(self.pixels)
+        self._faded = numpy.zeros_like(self._buffer)
+        self._fade_new = numpy.zeros(self.pixels.shape, dtype=numpy.uint16)
+        self._fade_old = numpy.zeros(self.pixels.shape, dtype=numpy.uint16)
+
+        # One of each effect, made the first time the mode gets picked so
+        # they keep their state when switching back and forth.  Modes that
+        # are the same effect at a different rate (boat, fast_boat and
+        # speed_boat) share one so the waves carry on where they were.
+        self.effects = dict()
+        self.mode = DEFAULT_MODE
     
     @property
     def spin_rate(self):
@@ -197,350 +358,191 @@ class Boat:
 
     @mode.setter
     def mode(self, value):
+        if value not in effects.REGISTRY:
+            #raise NotImplemented
+            print(f"Mode {value!r} not implemented")
+            value = DEFAULT_MODE
+
+        kind = effects.REGISTRY[value]
+        if kind not in self.effects:
+            self.effects[kind] = effects.create(value, self)
+        old = self.effect if hasattr(self, '_mode') else None
+        was_fading = self.fading
         self._mode = value
-        self.disco_delay = 0
-
+        self.effect = self.effects[kind]
+        self.effect.start()
+
+        # boat, fast_boat and speed_boat only differ in speed so there's
+        # nothing to fade between (but any fade that's going keeps going).
+        if old is None or self.transition_time <= 0:
+            self.fading = None
+        elif old is not self.effect:
+            self._fade_from[:] = self.pixels
+            self.fading = old
+            self.fade_elapsed = 0.0
+        self.retire(old)
+        self.retire(was_fading)
+        for name in MODE_LAYERS:
+            self.layers.show(name, name in self.effect.layers)
+
+    # Tells an effect it's finished with once it's neither the mode nor
+    # fading out.
+    def retire(self, effect):
+        if effect is not None and effect is not self.effect and effect is not self.fading:
+            effect.stop()
+
+    # The same named strips (plus waves and rails) as the boat has but as
+    # views into some other frame buffer laid out like self.pixels.
+    def views(self, frame):
+        ranges = {**self.offsets, **self.groups}
+        return types.SimpleNamespace(**{name: frame[start:end] for name, (start, end) in ranges.items()})
+
+    # The full 512 pixel FadeCandy frame.  Note that this is the same buffer
+    # every time so copy it if you need to hang on to it.
     @property
     def strands(self):
-        strands = [[] for i in range(8)]
-        empty = [(0, 0, 0)] * 4
-
-        # Old setup: [Initial Incorrect Guesses]
-        # Strand 0: Ground effects -- 850 mA
-        # Strand 1: Left stern -- 600 mA
-        # Strand 2: Left bow -- 480 mA
-        # Strand 3: Right stern -- 600 mA
-        # Strand 4: Right bow -- 480 mA
-        # Strand 5: Poop deck -- 350 mA
-
-        # Strand[0]: Right stern (reversed)
-        strands[0] = [led.color for led in self.rail_right[::-1][RAIL_SIZE//2-KITT_SIZE:]] + \
-                     empty
-
-        # Strand[1]: Right bow
-        strands[1] = [led.color for led in self.rail_right[RAIL_SIZE//2:]] + \
-                     [led.color for led in self.kitt[:KITT_SIZE]] + \
-                     empty
-
-        # Strand[2]: Left stern (reversed)
-        strands[2] = [led.color for led in self.rail_left[::-1][RAIL_SIZE//2-KITT_SIZE:]] + \
-                     empty
-
-        # Strand[3]: Left bow
-        strands[3] = [led.color for led in self.rail_left[RAIL_SIZE//2:]] + \
-                     [led.color for led in self.kitt[KITT_SIZE:][::-1]] + \
-                     empty
-
-        # Strand[4]: Ground Effects
-        strands[4] = [led.color for led in self.wave_left] + \
-                     [led.color for led in self.wave_right[::-1]] + \
-                     empty
-        
-        # Strand[5]: Left nacelle
-        strands[5] = [led.color for led in self.nacelle_left] + ([(0, 0, 0)] * (64 - 24))
-
-        # Strand[6]: Left nacelle
-        strands[6] = [led.color for led in self.nacelle_right] + ([(0, 0, 0)] * (64 - 24))
-        
-        return strands
+        numpy.take(self._shown, self.strand_map, axis=0, out=self.frame)
+        return self.frame
+
+    # The LED at pos on the screen, or None if it's between them
+    def led_at(self, pos):
+        (x, dx), (y, dy) = (divmod(n, LED_SIZE + LED_GAP) for n in pos)
+        width, height = self.grid.shape
+        if dx >= LED_SIZE or dy >= LED_SIZE or not (0 <= x < width and 0 <= y < height):
+            return None
+        ix = self.grid[x, y]
+        return None if ix < 0 else int(ix)
 
     def click(self, pos):
         # Only really useful in debug mode
-        for strip_ix, strip in enumerate(self.strips):
-            for led_ix, led in enumerate(strip):
-                if led.rect.collidepoint(pos):
-                    old = led.color
-                    new = (255, 255, 255) if old == (0, 0, 0) else (0, 0, 0)
-                    print(f"Strand{strip_ix}[{led_ix}]: {old} -> {new}")
-                    led.color = new
-                    return
+        ix = self.led_at(pos)
+        if ix is None:
+            return
+        for strip_ix, (start, end) in enumerate(self.offsets.values()):
+            if start <= ix < end:
+                old = tuple(self.pixels[ix].tolist())
+                new = (255, 255, 255) if old == (0, 0, 0) else (0, 0, 0)
+                print(f"Strand{strip_ix}[{ix - start}]: {old} -> {new}")
+                self.pixels[ix] = new
+                return
 
     def update(self, dt_ms):
-        if not hasattr(self, self.mode):
-            #raise NotImplemented
-            print(f"Mode {self.mode!r} not implemented")
-            self.mode = DEFAULT_MODE
-        
         dt = dt_ms / 1e3
+        self.time += dt
         alpha = dt * self.spin_rate
-        self.nacelle_angles = (self.nacelle_angles + alpha) % 360
+        self.nacelle_angle = (self.nacelle_angle + alpha) % 360
         
         # Run the currently selected animation routine.
-        getattr(self, self.mode)()
-        
-    def debug(self):
-        pass
-
-    # Only useful for the space ship
-    def spin_nacelles(self, america=False):
-        for ix, angle in enumerate(self.nacelle_angles):
-            red = self.nacelle_level + self.nacelle_brightness[int(angle)]
-            self.nacelle_left[ix].color = (red, red // 4, 0)
-            self.nacelle_right[ix].color = (red, red // 4, 0)
-
-            if ix < TAIL_SIZE:
-                self.nacelle_left[ix + SPINNER_SIZE].color = (red, red // 4, 0)
-                self.nacelle_right[ix + SPINNER_SIZE].color = (red, red // 4, 0)
-
-    # This routine was used for the Rose, White, and Blue parade.  Unfortunatly:
-    # (a) The parade was in full daylight and no one could see the LEDs
-    # (b) The white stripes were on the wrong side of the boat.
-    def america(self):
-        if not hasattr(self, 'usa'):
-            self.usa = [(255, 0, 0), (255, 255, 255), (0, 0, 255)]
-
-        # Animate the waves
-        changed = False
-        r, g, b = self.usa[0]
-        d_color = 5
-        for ix in range(len(self.wave_left)):
-            for edge in (self.wave_left, self.wave_right):
-                if edge[ix].color != self.usa[0]:
-                    changed = True
-                    next = (edge[ix].color[0] + max(-d_color, (min(d_color, r - edge[ix].color[0]))),
-                            edge[ix].color[1] + max(-d_color, (min(d_color, g - edge[ix].color[1]))),
-                            edge[ix].color[2] + max(-d_color, (min(d_color, b - edge[ix].color[2]))),
-                           )
-                    edge[ix].color = next
-        if not changed:
-            self.usa = self.usa[1:] + [self.usa[0]]
-
-        # Animate Larson scanner
-        self.kitt_pos += self.kitt_dir
-        if (self.kitt_pos < 1) or (self.kitt_pos > (KITT_SIZE - 2) * 2):
-            edge = self.rail_left if self.kitt_pos < 1 else self.rail_right
-            for i in range(RAIL_SIZE - KITT_SIZE - 6, RAIL_SIZE - KITT_SIZE):
-                edge[i].color = (255, 255, 255)
-            self.kitt_dir *= -1
-            self.kitt_pos += self.kitt_dir
-        else:
-            self.rail_left[RAIL_SIZE - KITT_SIZE - 1].color = (255, 0, 0)
-            self.rail_right[RAIL_SIZE - KITT_SIZE - 1].color = (0, 0, 255)
-        
-        for led in self.kitt:
-            led.color = self.kitt_dark
-        for ix in range(self.kitt_pos, self.kitt_pos + self.kitt_size):
-            self.kitt[ix].color = (255, 255, 255)
-        half = self.kitt_pos + self.kitt_size if self.kitt_dir == 1 else self.kitt_pos - 1
-        self.kitt[half].color = (192, 192, 192)
-
-        # Pull the white stripes along the rails
-        for ix in range(RAIL_SIZE-KITT_SIZE-1):
-            self.rail_left[ix].color = self.rail_left[ix+1].color
-            self.rail_right[ix].color = self.rail_right[ix+1].color
-
-        self.spin_nacelles(america=True)
-
-    def speed_boat(self):
-        self.boat()     # The regular boat but super fast
-
-    def fast_boat(self):
-        self.boat()     # The regular boat but faster
-
-    # The enterprise LED routines.
-    def space(self):
-        self.boat(in_space=True)
-
-    # The pirate ship LED routines.
-    def boat(self, in_space=False):
-        # Animate the waves:
-        #       Remember the old biorythm BASIC programs you could type
-        #       in from a computer magazine.  This is basically that only
-        #       without the cheat code where my cirthday was always the 
-        #       best one.  Makes a scrolling sin wave with a smaller sine
-        #       wave (noise) on top.  The waves are in shades of blue with
-        #       peaks in pure white (chop)
-        self.wave_offset += 0.31
-        t = self.wave_offset
-        for ix, led in enumerate(self.wave_left):
-            level = self.wave_level
-            level += math.sin(t + ix) * 64
-            level += math.sin(t + (ix >> 2)) * 24
-            color = (0, 0, level) if level <= 255 else (255, 255, 255)
-            self.wave_left[ix].color = color
-            self.wave_right[ix].color = color
-
-        # Update speckles:
-        #       The rails are solid grey but have spots to break up the
-        #       monotony. The spots fade to grey over time.
-        target = self.rail_level[0]
-        for rail in (self.rail_left, self.rail_right):
-            for ix, led in enumerate(rail):
-                if led.color[0] != target:
-                    new_color = max(self.rail_level[0], led.color[0] - self.rail_decay)
-                    led.color = (new_color, new_color, new_color)
-
-            if random.random() < self.rail_prob:
-                dot = random.randrange(RAIL_SIZE - KITT_SIZE - 2) + 1
-                rail[dot].color = (255, 255, 255)
-                rail[dot-1].color = (200, 200, 200)
-                rail[dot+1].color = (200, 200, 200)
-
-        # The enterprise doesn't get the KITT-esque Larson scanner
-        if not in_space:
-            self.kitt_pos += self.kitt_dir
-            if (self.kitt_pos < 1) or (self.kitt_pos > (KITT_SIZE - 2) * 2):
-                self.kitt_dir *= -1
-                self.kitt_pos += self.kitt_dir
-            for led in self.kitt:
-                led.color = self.kitt_dark
-            for ix in range(self.kitt_pos, self.kitt_pos + self.kitt_size):
-                self.kitt[ix].color = (255, 0, 0)
-            half = self.kitt_pos + self.kitt_size if self.kitt_dir == 1 else self.kitt_pos - 1
-            self.kitt[half].color = (192, 0, 0)
-        else:
-            for led in self.kitt:
-                led.color = (255, 255, 255)
-                # TODO: If in red alert, make this (255, 0, 0)
-
-        # Add indicators:
-        #       Add collision lights on the corners of the boat.  Red on the left
-        #       and green on the right.
-        for starboard, rail in enumerate([self.rail_left, self.rail_right]):
-            color = (0, 255, 0) if starboard else (255, 0, 0)  # Good port wine is red
-            for ix in range(STERN_SIZE, STERN_SIZE+3):
-                rail[ix].color = color
-            for ix in range(RAIL_SIZE-NOSE_SIZE-2, RAIL_SIZE-NOSE_SIZE+1):
-                rail[ix].color = color
-
-        # Rotate the LEDs in the nacelles.  If the motor and slipring had worked
-        # this would have been done in hardware.
-        self.spin_nacelles()
-
-    def slow(self):
-        if self.disco_delay == 0:
-            #self.disco(low=128)  # Too pastel
-            self.disco()
-            self.disco_delay = 5
-        else:
-            self.disco_delay -= 1
-
-    def panic(self):
-        self.disco()
-
-    def disco(self, low=0, high=255):
-        for strip in self.strips:
-            for led in strip:
-                led.color = (random.randint(low, high),
-                             random.randint(low, high),
-                             random.randint(low, high))
-
-    # Added this after figuring out that there was no way to turn off the
-    # lights except to unplug the LED power supply or the Pi.
-    def off(self):
-        for strip in self.strips:
-            for led in strip:
-                led.color = (0, 0, 0)
-
-    # Turn on all of the LEDs to full power.  Great for debugging and setting
-    # the poop deck on fire.
-    def bright(self):
-        for strip in self.strips:
-            for led in strip:
-                led.color = (255, 255, 255)
-
+        self.effect.render(self.pixels, self.time, dt)
+
+        # Never more than two modes drawn in a frame: the new one and
+        # (while fading) the one before it.
+        shown = self._buffer
+        if self.fading:
+            self.fade_elapsed += dt
+            if self.fade_elapsed < self.transition_time:
+                self.fading.render(self._fade_from, self.time, dt)
+                shown = self.crossfade(self.fade_elapsed / self.transition_time)
+            else:
+                old, self.fading = self.fading, None
+                self.retire(old)
+        self._shown = self.layers.render(shown, self.time, dt)
+
+    # Linear blend from the old mode to the new one, amount of the way there
+    def crossfade(self, amount):
+        weight = int(amount * 256)
+        numpy.multiply(self.pixels, weight, out=self._fade_new, dtype=numpy.uint16)
+        numpy.multiply(self._fade_from, 256 - weight, out=self._fade_old, dtype=numpy.uint16)
+        self._fade_new += self._fade_old
+        self._fade_new >>= 8
+        self._faded[:len(self.pixels)] = self._fade_new
+        return self._faded
+
+    # Only useful for the space ship.  The current row of the nacelle table.
+    def nacelles(self):
+        phase = int(self.nacelle_angle * NACELLE_PHASES / 360) % NACELLE_PHASES
+        return self.nacelle_table[phase]
+
+    # Moves effect's waves along one step and returns the new wave_left.
+    def next_wave(self, effect):
+        effect.wave_offset = (effect.wave_offset + WAVE_STEP) % (2 * numpy.pi)
+        phase = round(effect.wave_offset * WAVE_PHASES / (2 * numpy.pi)) % WAVE_PHASES
+        return self.wave_table[phase]
+
+    # Where the next speckle goes on each rail (0 for no speckle).  Drawn a
+    # block of frames at a time as one random number at a time is slow.
+    def next_speckles(self, effect):
+        if not effect.speckles:
+            chance = self.rng.random((SPECKLE_BLOCK, 2)) < self.rail_prob
+            dots = self.rng.integers(1, RAIL_SIZE - KITT_SIZE - 1, size=(SPECKLE_BLOCK, 2))
+            effect.speckles = numpy.where(chance, dots, 0).tolist()[::-1]
+        return effect.speckles.pop()
+
+    # Only redraws the LEDs that changed since the last call and returns
+    # their rects for pygame.display.update().  Most modes only change a
+    # handful of LEDs a frame (and off/bright/debug change none at all).
+    #
+    # All the changed LEDs get filled in one go, straight into the surface's
+    # pixels, rather than a pygame.draw.rect() each.  The surface has to be
+    # 32 bit (the simulator window always is).
     def draw(self, surf):
-        for strip in self.strips:
-            for led in strip:
-                led.draw(surf, self.brightness)
+        colors = (self._shown[:len(self.pixels)] * self.brightness).astype(numpy.int16)
+        changed = numpy.flatnonzero((colors != self._drawn).any(axis=1))
+        if not len(changed):
+            return []
+        self._drawn[changed] = colors[changed]
+
+        # The colours as the surface's own 32 bit pixel values
+        shifts = numpy.array(surf.get_shifts()[:3], dtype=numpy.uint32)
+        mapped = numpy.bitwise_or.reduce(colors[changed].astype(numpy.uint32) << shifts, axis=1)
+        mapped |= surf.get_masks()[3]
+
+        rects = self.rects[changed]
+        screen = pygame.surfarray.pixels2d(surf)
+        screen[rects[:, 0, None, None] + self._dot_x,
+               rects[:, 1, None, None] + self._dot_y] = mapped[:, None, None]
+        del screen  # Unlocks the surface
+        return rects.tolist()
+
+    # Forget what's on the screen so the next draw() does everything.
+    def invalidate(self):
+        self._drawn[:] = -1
 
 # Only needed for funky poop deck LEDs
 def rgb2gbr(c):
     return (c[1], c[0], c[2])
 
-def generate_waves(level, top=True):
-    color = (0, 0, level)
-
-    y = (LED_SIZE + LED_GAP) * 12
-    if not top:
-        bottom = ((LED_SIZE + LED_GAP) * NOSE_SIZE * 2) - LED_SIZE - LED_GAP
-        y = bottom - y
-    base_x = (LED_SIZE + LED_GAP) * 30
-
-    pixels = []
-    for ix in range(WAVE_SIZE):
-        x = ((LED_SIZE + LED_GAP) * ix) + base_x
-        pixels.append(Led((x, y), (LED_SIZE, LED_SIZE), color))
-    return pixels
-
-def get_rail_pos(ix):
-    if ix < STERN_SIZE:
-        x = 0
-        dy = (LED_SIZE + LED_GAP) * (STERN_SIZE - ix)
-    else:
-        x = (LED_SIZE + LED_GAP) * (ix - STERN_SIZE)
-        dy = max(0, (LED_SIZE + LED_GAP) * (ix - PROW))
-
-    return x, dy
-
-def get_spinner_pos(ix, port):
-    base_x = SPINNER_X
-    base_y = SPINNER_TOP if port else SPINNER_BOT
-
-    if ix < 4: # Top
-        x = base_x + (LED_SIZE + LED_GAP) * ix
-        y = base_y
-    elif ix < 8:
-        x = base_x + (LED_SIZE + LED_GAP) * 4
-        y = base_y + (LED_SIZE + LED_GAP) * (ix - 4 + 1)
-    elif ix < 12:
-        x = base_x + (LED_SIZE + LED_GAP) * 3
-        x -= (LED_SIZE + LED_GAP) * (ix - 8)
-        y = base_y + (LED_SIZE + LED_GAP) * 5
-    else:
-        x = base_x - (LED_SIZE + LED_GAP)
-        y = base_y + (LED_SIZE + LED_GAP) * 3
-        y -= (LED_SIZE + LED_GAP) * (ix - 12 - 1)
-    return x, y
-
-def get_tail_pos(ix, port):
-    x = TAIL_X + (LED_SIZE + LED_GAP) * (ix % (TAIL_SIZE // 2))
-    y = (SPINNER_TOP if port else SPINNER_BOT) + (LED_SIZE + LED_GAP)
-
-    if ix >= (TAIL_SIZE / 2):
-        y += (LED_SIZE + LED_GAP) * 3
-
-    return x, y
-
-def generate_nacelle(colour, port):
-    pixels = []
-    c = (colour, colour // 4, 0)
-
-    for ix in range(SPINNER_SIZE):
-        x, y = get_spinner_pos(ix, port)
-        # print(f"Nacelle {ix}: {(x, y)}")
-        pixels.append(Led((x, y), (LED_SIZE, LED_SIZE), c))
-    
-    for ix in range(TAIL_SIZE):
-        x, y = get_tail_pos(ix, port)
-        # print(f"Tail {ix}: {(x, y)}")
-        pixels.append(Led((x, y), (LED_SIZE, LED_SIZE), c))
-
-    return pixels
-
-def generate_rail(brightness, top=True):
-    bottom = ((LED_SIZE + LED_GAP) * NOSE_SIZE * 2) - LED_SIZE - LED_GAP
-    pixels = []
-
-    for ix in range(RAIL_SIZE - KITT_SIZE):
-        x, dy = get_rail_pos(ix)
-        y = dy if top else bottom - dy
-        pixels.append(Led((x, y), (LED_SIZE, LED_SIZE), brightness))
-    return pixels
-
-def generate_kitt(dark_level):
-    bottom = ((LED_SIZE + LED_GAP) * NOSE_SIZE * 2) - LED_SIZE - LED_GAP
-    pixels = []
-
-    for ix in range(RAIL_SIZE - KITT_SIZE, RAIL_SIZE):
-        x, dy = get_rail_pos(ix)
-        pixels.append(Led((x, dy), (LED_SIZE, LED_SIZE), dark_level))
-
-    for ix in range(RAIL_SIZE - 1, RAIL_SIZE - KITT_SIZE - 1, -1):
-        x, dy = get_rail_pos(ix)
-        pixels.append(Led((x, bottom - dy), (LED_SIZE, LED_SIZE), dark_level))
-
-    return pixels
+# Every frame of the waves (see Boat.boat) for one trip around the sine wave.
+def generate_wave_table(level):
+    t = numpy.arange(WAVE_PHASES)[:, None] * (2 * numpy.pi / WAVE_PHASES)
+    ix = numpy.arange(WAVE_SIZE)
+    levels = level + numpy.sin(t + ix) * 64
+    levels += numpy.sin(t + (ix >> 2)) * 24
+
+    table = numpy.zeros((WAVE_PHASES, WAVE_SIZE, 3), dtype=numpy.uint8)
+    table[:, :, 2] = numpy.minimum(levels, 255)
+    table[levels > 255] = (255, 255, 255)
+    return table
+
+# Every position of the nacelle spinners (and tails).  Each spinner LED is
+# evenly spaced around the circle and gets a brightness from its angle.
+def generate_nacelle_table(level, freq):
+    brightness = (numpy.sin(numpy.arange(360) * freq / (2 * numpy.pi)) + 1) * 0.5
+    brightness *= 255 - level
+
+    spinners = numpy.linspace(0, 360, SPINNER_SIZE + 1)[:-1]
+    angles = (numpy.arange(NACELLE_PHASES)[:, None] * (360 / NACELLE_PHASES) + spinners) % 360
+    red = level + brightness[angles.astype(int)]
+
+    spinner = numpy.zeros((NACELLE_PHASES, SPINNER_SIZE, 3), dtype=numpy.uint8)
+    spinner[:, :, 0] = red
+    spinner[:, :, 1] = red // 4
+    return numpy.concatenate((spinner, spinner[:, :TAIL_SIZE]), axis=1)
+
+# Loads the effects in path and gives them any keys they asked for
+def load_plugins(path):
+    effects.load_plugins(path)
+    add_effect_keys()
 
 def parse_args():
     global LED_SIZE     # Hacky McHack calling
@@ -553,10 +555,55 @@ def parse_args():
     parser.add_argument('--size', action='store', type=int, default=LED_SIZE,
                         help='Size of the LEDs in pixels')
     parser.add_argument('-n', '--dry_run', action='store_true', help='No fadecandy connection')
+    parser.add_argument('--headless', action='store_true',
+                        help='No simulator window. Keys are read from the keypad or stdin')
+    parser.add_argument('--keyboard', action='append', default=None,
+                        help='evdev keyboard device for headless mode, can be given more than once '
+                             '(default: every keyboard found)')
     parser.add_argument('-f', '--freq', type=float, default=1.0, help='Nacelle brightness frequency')
+    parser.add_argument('--output_rate', type=int, default=OUTPUT_RATE,
+                        help='Rate (fps) frames are sent to the Fadecandy')
+    parser.add_argument('--keepalive', type=float, default=KEEPALIVE_TIME,
+                        help='Seconds between resending unchanged frames (0 sends every frame)')
+    parser.add_argument('-g', '--gamma', type=float, default=None,
+                        help='Gamma correction for the LEDs (fcserver normally does this)')
+    parser.add_argument('--limit', action='store_true', help='Limit each strand to its current budget')
+    parser.add_argument('-b', '--budget', type=float, default=None,
+                        help='Total LED current budget in mA. The output is dimmed to stay inside it')
+    parser.add_argument('--fade', type=float, default=FADE_MODES,
+                        help='Seconds to cross-fade between modes (0 to switch instantly)')
+    parser.add_argument('--audio_device', action='store', default=None,
+                        help='Capture device for the music mode to listen to (default: follow the background music)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for the random effects so runs (and recordings) repeat exactly')
+    parser.add_argument('--bench', action='store_true',
+                        help='Benchmark every mode (no display or Fadecandy) and print JSON results')
+    parser.add_argument('--frames', type=int, default=1000, help='Number of frames per mode to benchmark or render')
+    parser.add_argument('--record', action='store', default=None, help='Record the LED output to this file')
+    parser.add_argument('--record_format', choices=RECORD_FORMATS, default='raw',
+                        help='Recording format (raw can be memory mapped, rle is much smaller)')
+    parser.add_argument('--render', action='store', default=None,
+                        help='Render --frames frames of a mode to the --record file as fast as possible')
+    parser.add_argument('--replay', action='store', default=None,
+                        help='Play a recording straight to the Fadecandy (no animation, display or sound)')
+    parser.add_argument('--loop', action='store_true', help='Keep replaying the recording')
+    parser.add_argument('--plugins', action='store', default=None,
+                        help='Directory of extra effects (modes) to load')
+    parser.add_argument('--overlay', action='store_true', help='Start with the performance overlay on')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print frame rate stats')
     args = parser.parse_args()
+    if args.plugins:
+        load_plugins(args.plugins)
+    if args.render and args.render not in effects.REGISTRY:
+        parser.error(f"--render: unknown mode {args.render!r} (choose from {', '.join(effects.REGISTRY)})")
+    if args.render and not args.record:
+        parser.error("--render needs a --record file")
     assert 1024 <= args.port <= 65535
     assert 1 <= args.size
+    assert 1 <= args.output_rate
+    assert 0 <= args.keepalive
+    assert 1 <= args.frames
+    assert 0 <= args.fade
 
     LED_SIZE = args.size
     
@@ -569,13 +616,16 @@ def play_background(in_space):
     # Note: The background sound should be a MP3 as, for some reason,
     #       I can't get it to work with OGG files.
     if in_space:
-        pygame.mixer.music.load(SPACE_MUSIC)
+        path = SPACE_MUSIC
+        pygame.mixer.music.load(path)
         pygame.mixer.music.set_volume(0.707)
     else:
-        pygame.mixer.music.load(BOAT_MUSIC)
+        path = BOAT_MUSIC
+        pygame.mixer.music.load(path)
         pygame.mixer.music.set_volume(1.0)
 
     pygame.mixer.music.play(loops=-1)
+    return path
     # print(f"{pygame.mixer.music.get_volume()=}")
 
 def background_low():
@@ -586,255 +636,361 @@ def background_high():
     print("Restore background")
     pygame.mixer.music.set_volume(0.707)
 
-# Preload all of the sound files.
+# Finds all of the sound files.  They get loaded by a SoundBank (see
+# sounds.py) in the background.
 def load_sounds(sfx_dir):
-    alarms = []
-    for filename in glob.glob(os.path.join(sfx_dir, 'alarm*.mp3')):
-        alarms.append(pygame.mixer.Sound(filename))
-
-    fire = []
-    for filename in glob.glob(os.path.join(sfx_dir, 'fire_*.mp3')):
-        fire.append(pygame.mixer.Sound(filename))
-
-    comms = pygame.mixer.Sound(os.path.join(sfx_dir, 'comms.mp3'))
-    whistle = pygame.mixer.Sound(os.path.join(sfx_dir, 'whistle.mp3'))
-    theme = pygame.mixer.Sound(os.path.join(sfx_dir, 'theme.mp3'))
-    warp_long = pygame.mixer.Sound(os.path.join(sfx_dir, 'warp_long.mp3'))
-    warp_exit = pygame.mixer.Sound(os.path.join(sfx_dir, 'warp_exit.mp3'))
-    warp_plaid = pygame.mixer.Sound(os.path.join(sfx_dir, 'warp_plaid.mp3'))
-    alert = pygame.mixer.Sound(os.path.join(sfx_dir, 'red_alert.mp3'))
+    alarms = sorted(glob.glob(os.path.join(sfx_dir, 'alarm*.mp3')))
+    fire = sorted(glob.glob(os.path.join(sfx_dir, 'fire_*.mp3')))
 
     sfx = {'alarms': alarms,
            'fire': fire,
-           'comms': comms,
-           'whistle': whistle,
-           'theme': theme,
-           'alert': alert,
-           'warp': {'long': warp_long, 
-                    'exit': warp_exit, 
-                    'plaid': warp_plaid},
+           'comms': os.path.join(sfx_dir, 'comms.mp3'),
+           'whistle': os.path.join(sfx_dir, 'whistle.mp3'),
+           'theme': os.path.join(sfx_dir, 'theme.mp3'),
+           'alert': os.path.join(sfx_dir, 'red_alert.mp3'),
+           'warp': {'long': os.path.join(sfx_dir, 'warp_long.mp3'), 
+                    'exit': os.path.join(sfx_dir, 'warp_exit.mp3'), 
+                    'plaid': os.path.join(sfx_dir, 'warp_plaid.mp3')},
           }
     return sfx
 
+# Draws the lines of text over the simulator and returns the rect that needs
+# updating.  Anything too long is cut off rather than drawn over the LEDs.
+def draw_overlay(surf, font, lines):
+    rect = pygame.Rect(OVERLAY_RECT)
+    surf.fill((0, 0, 0), rect)
+    surf.set_clip(rect)
+    for ix, line in enumerate(lines):
+        surf.blit(font.render(line, True, OVERLAY_COLOR), (rect.x, rect.y + ix * font.get_linesize()))
+    surf.set_clip(None)
+    return rect
+
 def main(args):
-    client = opc.Client(f'{args.host}:{args.port}') if not args.dry_run else None
+    # One output thread (and connection) per controller in layout.json
+    output = None
+    if not args.dry_run:
+        output = FanOut(LAYOUT.controllers, f'{args.host}:{args.port}', args.output_rate,
+                        dithering=TEMPORAL_DITHERING, keepalive=args.keepalive, verbose=args.verbose)
 
     warping = None
     
+    # Nobody looks at the simulator on the boat.  Headless still needs the
+    # event queue (for the keys and the sound end events) but SDL's dummy
+    # video driver is enough for that.
+    if args.headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
     pygame.init()
     pygame.mixer.init()
-    width = (RAIL_SIZE - STERN_SIZE) * (LED_SIZE + LED_GAP)
-    height = NOSE_SIZE * (LED_SIZE + LED_GAP) * 2
-    screen = pygame.display.set_mode((width, height), 0, 32)
-    pygame.display.set_caption("Boat Light Sim")
-    print("Loading SFX...", flush=True)
+    screen = None
+    if args.headless:
+        keypad.start_reader(args.keyboard)
+    else:
+        width, height = (n * (LED_SIZE + LED_GAP) for n in LAYOUT.screen)
+        screen = pygame.display.set_mode((width, height), 0, 32)
+        pygame.display.set_caption("Boat Light Sim")
     sfx = load_sounds(SFX_DIR)
+    bank = SoundBank(verbose=args.verbose)
+    bank.preload(sound_files(sfx))
+    player = SoundScheduler(SFX_CHANNELS, ducking=SFX_DUCKING)
     
-    assert pygame.mixer.get_num_channels() >= len(SFX_CHANNELS)
-    channels = dict()
-    for name, ch in SFX_CHANNELS.items():
-        channels[name] = pygame.mixer.Channel(ch)
-    sfx_queue = dict()
-    
-    boat = Boat(nacelle_freq=args.freq)
-    rate = int(1.0 / RATES[boat.mode] * 1000)  # frame rate in ms
+    boat_seed, sfx_seed = split_seed(args.seed)
+    if args.verbose:
+        print(f"Random seed: {boat_seed.entropy}", file=sys.stderr)
+    sfx_rng = numpy.random.default_rng(sfx_seed)
+
+    boat = Boat(nacelle_freq=args.freq, seed=boat_seed, transition_time=args.fade)
+
+    # The music mode listens to a capture device if it's given one, otherwise
+    # it follows along with the background music.  Nothing runs until the
+    # mode is first picked and it goes idle again once the mode is gone.
+    if args.audio_device:
+        audio_source = audio.CaptureSource(args.audio_device)
+    else:
+        audio_source = audio.FileSource()
+    boat.audio = audio.AudioAnalyzer(audio_source)
+    pipeline = ColorPipeline(boat.strand_sizes, STRAND_LENGTH, gamma=args.gamma,
+                             budgets=STRAND_BUDGETS if args.limit else None)
+    monitor = PowerMonitor(boat.strand_sizes, STRAND_LENGTH, budget=args.budget)
+    if output:
+        output.start()
+    clock = FrameClock(mode_rate(boat.mode))
+    next_stats = time.monotonic() + STATS_INTERVAL
     mute = False
 
-    play_background(boat.mode == 'space')
-
-    running = True
-    while running:
-        # Great big giant IF/THEN/ELSE for the event queue.  Not ideal.
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                # Handle the key presses.
-                if event.key == pygame.K_ESCAPE:
+    # Performance stats.  These are always collected and can be seen on the
+    # overlay, every STATS_INTERVAL in verbose mode or with a SIGUSR1.
+    timer = StageTimer(LOOP_STAGES)
+
+    def stats():
+        lines = [f"{boat.mode}: {clock.report()}",
+                 f"power: {monitor.report()}",
+                ] + timer.report()
+        if output:
+            lines.extend(output.report())
+        if boat.audio.ident is not None:
+            lines.append(boat.audio.report())
+        return lines
+
+    def dump_stats(*_):
+        print('\n'.join(stats()), file=sys.stderr, flush=True)
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, dump_stats)
+
+    overlay = args.overlay and screen is not None
+    overlay_drawn = False
+    next_overlay = 0
+    font = pygame.font.Font(None, OVERLAY_FONT_SIZE) if screen else None
+
+    recorder = None
+    if args.record:
+        recorder = Recorder(args.record, len(boat.frame), args.record_format)
+        record_start = time.monotonic()
+
+    audio_source.follow(play_background(boat.mode == 'space'))
+
+    # The recording gets closed however we leave the loop (^C, a crash)
+    # so it ends on a whole frame.
+    try:
+        running = True
+        while running:
+            timer.start()
+
+            # Great big giant IF/THEN/ELSE for the event queue.  Not ideal.
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
                     running = False
-
-                # Mute or unmute.  This is on KP_0 so it's easy to get
-                # to on a numeric keyboard.  Useful if you are going to
-                # be parked somewhere and want the lights but don't want
-                # to interfere with someone else's music.
-                if event.key == pygame.K_KP_PERIOD:
-                    mute = not mute
-                    if mute:
-                        pygame.mixer.music.pause()
-                    else:
-                        pygame.mixer.music.unpause()
-
-                # Handle the change in animation routines.
-                elif event.key in MODES:
-                    new_mode = MODES[event.key]
-                    if new_mode != boat.mode:
-                        print(f"Setting mode: {MODES[event.key]!r}")
-                        was_space = boat.mode == 'space'
-                        is_space = new_mode == 'space'
-                        if was_space != is_space:
-                            play_background(new_mode == 'space')
-                        boat.mode = new_mode
-                        rate = int(1.0 / RATES[boat.mode] * 1000)  # frame rate in ms
-
-                # The default is to run the lights at full brightness.  This can
-                # be a bit much is some situations.  Use the +/- on the numeric
-                # keypad to change the brightness.
-                elif event.key == pygame.K_KP_PLUS:
-                    boat.brightness = min(1.0, boat.brightness + BRIGHT_STEP)
-                    print(f"Brightness increased to {boat.brightness:0.02f}")
-                elif event.key == pygame.K_KP_MINUS:
-                    boat.brightness = max(0.1, boat.brightness - BRIGHT_STEP)
-                    print(f"Brightness decreased to {boat.brightness:0.02f}")
-
-                # Sounds can be played by pressing keys.  The keyboard is hidden
-                # in the starboard poopdeck area.  Be subtle and it looks/sounds
-                # amazing.
-                elif event.unicode in SFX_KEYS:
-                    sound_type = SFX_KEYS[event.unicode]
-                    # SFX_CHANNELS = {'warp': 0, 'fire': 1, 'alert': 2, 'general': 4}
-
-                    # Oh dear... I added this hours before the first sailing with
-                    # the spaceship.  This is a poorly designed sound queue and
-                    # mostly, kinda, works... not my proudest moment.
-                    if sound_type == 'alarm':
-                        snd = random.choice(sfx['alarms'])
-                        if channels['general'].get_busy():
-                            channels['general'].fadeout(500)
-                            sfx_queue['general'] = snd
+                elif event.type == pygame.KEYDOWN:
+                    # Handle the key presses.
+                    if event.key == pygame.K_ESCAPE:
+                        running = False
+
+                    # Mute or unmute.  This is on KP_0 so it's easy to get
+                    # to on a numeric keyboard.  Useful if you are going to
+                    # be parked somewhere and want the lights but don't want
+                    # to interfere with someone else's music.
+                    if event.key == pygame.K_KP_PERIOD:
+                        mute = not mute
+                        if mute:
+                            pygame.mixer.music.pause()
                         else:
-                            channels['general'].play(snd)
-                    elif sound_type == 'fire':
-                        snd = random.choice(sfx['fire'])
-                        if channels['fire'].get_busy():
-                            channels['fire'].fadeout(500)
-                            sfx_queue['fire'] = snd
+                            pygame.mixer.music.unpause()
+
+                    # Handle the change in animation routines.
+                    elif event.key in MODES:
+                        new_mode = MODES[event.key]
+                        if new_mode != boat.mode:
+                            print(f"Setting mode: {MODES[event.key]!r} (was {clock.report()})")
+                            was_space = boat.mode == 'space'
+                            is_space = new_mode == 'space'
+                            if was_space != is_space:
+                                audio_source.follow(play_background(new_mode == 'space'))
+                            boat.mode = new_mode
+                            clock.fps = mode_rate(boat.mode)
+
+                    # The default is to run the lights at full brightness.  This can
+                    # be a bit much is some situations.  Use the +/- on the numeric
+                    # keypad to change the brightness.
+                    elif event.key == pygame.K_KP_PLUS:
+                        boat.brightness = min(1.0, boat.brightness + BRIGHT_STEP)
+                        pipeline.brightness = boat.brightness
+                        print(f"Brightness increased to {boat.brightness:0.02f}")
+                    elif event.key == pygame.K_KP_MINUS:
+                        boat.brightness = max(0.1, boat.brightness - BRIGHT_STEP)
+                        pipeline.brightness = boat.brightness
+                        print(f"Brightness decreased to {boat.brightness:0.02f}")
+
+                    # Show/hide the performance overlay
+                    elif event.key == pygame.K_i and screen:
+                        overlay = not overlay
+                        next_overlay = 0
+
+                    # Sounds can be played by pressing keys.  The keyboard is hidden
+                    # in the starboard poopdeck area.  Be subtle and it looks/sounds
+                    # amazing.
+                    elif event.unicode in SFX_KEYS:
+                        sound_type = SFX_KEYS[event.unicode]
+                        if sound_type in ('warp', 'plaid'):
+                            if player.idle('warp'):
+                                warping = None
+                            sound, fade, warping = WARP_STATES[warping, sound_type]
+                            if sound is None:
+                                player.stop('warp', fade)
+                            else:
+                                player.play('warp', bank[sfx['warp'][sound]],
+                                            crossfade=fade or 0, interrupt=fade is not None)
+                            boat.layers.show('warp', warping in ('long', 'plaid'))
+                        elif sound_type == 'alert':
+                            if not player.idle('alert'):
+                                player.stop('alert', 1000)
+                                boat.layers.hide('red_alert')
+                            else:
+                                player.play('alert', bank[sfx['alert']], loops=-1)
+                                boat.layers.show('red_alert')
                         else:
-                            channels['fire'].play(snd)
-                    elif sound_type == 'warp':
-                        if not channels['warp'].get_busy():
-                            warping = None
-                        # print(f"{warping=}")
-                        if warping == 'plaid':
-                            channels['warp'].fadeout(1000)
-                            sfx_queue['warp'] = sfx['warp']['long']
-                            warping = 'long'
-                            # print("Plaid -> Warp")
-                        elif warping == 'exit':
-                            sfx_queue['warp'] = sfx['warp']['long']
-                            warping = 'long'
-                            # print("Exit -> Warp")
-                        elif warping == 'long':
-                            channels['warp'].fadeout(500)
-                            sfx_queue['warp'] = sfx['warp']['exit']
-                            warping = 'exit'
-                            print("Warp -> Exit")
-                        elif warping is None:
-                            sfx_queue['warp'] = sfx['warp']['long']
-                            warping = 'long'
-                            # print("Warp Entry")
-                        else:
-                            print(f"Funky warp detected", file=sys.stderr)
-                    elif sound_type == 'plaid':
-                        # print("PLAID!")
-                        if not channels['warp'].get_busy():
-                            warping = None
-                        # print(f"{warping=}")
-                        if warping == 'plaid':
-                            channels['warp'].fadeout(1000)
-                            warping = None
-                            # print("Plaid -> None")
-                        elif warping == 'exit':
-                            sfx_queue['warp'] = sfx['warp']['plaid']
-                            warping = 'plaid'
-                            # print("Exit -> plaid")
-                        elif warping == 'long':
-                            channels['warp'].fadeout(1000)
-                            sfx_queue['warp'] = sfx['warp']['plaid']
-                            warping = 'plaid'
-                            # print("Warp -> Plaid")
-                        elif warping is None:
-                            sfx_queue['warp'] = sfx['warp']['plaid']
-                            warping = 'plaid'
-                            # print("Plaid Entry")
-                        else:
-                            print(f"Funky plaid warp detected", file=sys.stderr)
-                    elif sound_type == 'alert':
-                        if channels['alert'].get_busy():
-                            channels['alert'].fadeout(1000)
-                        else:
-                            channels['alert'].play(sfx['alert'], loops=-1)
+                            if sound_type == 'alarm':
+                                snd = bank[sfx['alarms'][sfx_rng.integers(len(sfx['alarms']))]]
+                            elif sound_type == 'fire':
+                                snd = bank[sfx['fire'][sfx_rng.integers(len(sfx['fire']))]]
+                            else:
+                                snd = bank[sfx[sound_type]]
+                            channel, priority = SFX_PRIORITIES[sound_type]
+                            player.play(channel, snd, priority=priority, crossfade=SFX_CROSSFADE)
                     else:
-                        snd = sfx[sound_type]
-                        if channels['general'].get_busy():
-                            channels['general'].fadeout(500)
-                            sfx_queue['general'] = snd
-                        else:
-                            channels['general'].play(snd)
+                        # print(f"Unknown key {event.unicode!r}, {event.key=}")
+                        pass
+            
+                # For debugging, you can click on an individual LED and have it
+                # toggle.  This is great for debugging and finding out which LEDs
+                # are bad.
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    if event.button == 1:
+                        boat.click(event.pos)
+
+                # The window got covered up or restored so redraw all of it.
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    boat.invalidate()
+
+                # A sound effect finished.  Start the next one (and bring the
+                # background back up if it was ducked).
+                elif player.handle(event):
+                    if player.idle('warp'):
+                        warping = None
+                        boat.layers.hide('warp')
                 else:
-                    # print(f"Unknown key {event.unicode!r}, {event.key=}")
+                    # print(repr(event))
+                    # print(f"{event=}, {event.type=}")
                     pass
-            
-            # For debugging, you can click on an individual LED and have it
-            # toggle.  This is great for debugging and finding out which LEDs
-            # are bad.
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    boat.click(event.pos)
-
-            # Some SFX ducks the background audio.  This should bring it back
-            # when they are done.
-            elif event.type == pygame.USEREVENT:
-                # background_high()
-                print("Restore background")
-                pygame.mixer.music.set_volume(0.707)
-            else:
-                # print(repr(event))
-                # print(f"{event=}, {event.type=}")
-                pass
-
-        # Update the display.
-        dt = pygame.time.wait(rate)
-        boat.update(dt)
-        boat.draw(screen)
-        pygame.display.flip()
-
-        # Dumb sound queue.
-        for q in sfx_queue:
-            if sfx_queue[q] is not None:
-                if not channels[q].get_busy():
-                    if q in ('warp', 'plaid'):
-                        channels['warp'].set_endevent(pygame.USEREVENT)
-                        # background_low()
-                        print("Ducking background")
-                        pygame.mixer.music.set_volume(0.3)
-                    channels[q].play(sfx_queue[q])
-                    sfx_queue[q] = None
-
-        # Update the LEDs.
-        if client:
-            strands = boat.strands
-            client.put_pixels(sum(strands, []))
-            if not TEMPORAL_DITHERING:
-                client.put_pixels(sum(strands, []))
-
-    # When quitting, fade out the LEDs and the sounds.
-    quit_fade = [(0, 0, 0)] * 512
-    if client:
-        client.put_pixels(sum(strands, []))
+
+            timer.mark('events')
+
+            # Update the display.  The animations advance by however much time
+            # really passed, not by what we asked for.
+            dt = clock.tick()
+            timer.mark('wait')
+            boat.update(dt)
+            timer.mark('update')
+            if screen:
+                rects = boat.draw(screen)
+                if overlay and time.monotonic() > next_overlay:
+                    rects.append(draw_overlay(screen, font, stats()))
+                    overlay_drawn = True
+                    next_overlay = time.monotonic() + OVERLAY_INTERVAL
+                elif not overlay and overlay_drawn:
+                    rects.append(screen.fill((0, 0, 0), OVERLAY_RECT))
+                    overlay_drawn = False
+                timer.mark('draw')
+                if rects:
+                    pygame.display.update(rects)
+                timer.mark('flip')
+
+            # Work out how much power that frame would take and turn things down
+            # if it's too much.  This lags a frame behind but that's fine.
+            frame = pipeline.apply(boat.strands)
+            pipeline.limit = monitor.update(frame, dt / 1000)
+
+            # Hand the LEDs over to the output thread.  It will pick up the
+            # latest frame whenever it is next ready to send.
+            if output:
+                output.publish(frame)
+            if recorder:
+                recorder.write(frame, time.monotonic() - record_start)
+            timer.mark('output')
+            timer.end()
+
+            if args.verbose and time.monotonic() > next_stats:
+                dump_stats()
+                next_stats += STATS_INTERVAL
+    finally:
+        if recorder:
+            recorder.close()
+
+    # When quitting, fade out the LEDs and the sounds.  The output thread has
+    # to stop first so we can talk to the Fadecandy directly.
+    if output:
+        output.stop()
+    boat.audio.stop()
+
+    quit_fade = numpy.zeros_like(boat.frame)
+    if output:
+        output.put_pixels(pipeline.apply(boat.strands))
         time.sleep(FADE_TIME / 1000.0)
-        client.put_pixels(quit_fade)
+        output.put_pixels(quit_fade)
 
     pygame.mixer.music.fadeout(FADE_TIME)  # Stop the background sounds
     pygame.mixer.fadeout(FADE_TIME)        # Stop any sound effects
     time.sleep(FADE_TIME / 1000.0)
 
     # Turn off all of the LEDs when exiting
-    if client:
-        client.put_pixels(quit_fade)
-        client.put_pixels(quit_fade)
+    if output:
+        output.put_pixels(quit_fade)
+        output.put_pixels(quit_fade)
 
     pygame.quit()
 
+# Renders a mode offline, as fast as it'll go, with the same frame timing it
+# would have had live.  Good for shows that are too heavy to run on the Pi
+# and for having known frames to test against.
+def render(args):
+    boat_seed, _ = split_seed(args.seed)
+    boat = Boat(nacelle_freq=args.freq, seed=boat_seed)
+    boat.mode = args.render
+    pipeline = ColorPipeline(boat.strand_sizes, STRAND_LENGTH, gamma=args.gamma,
+                             budgets=STRAND_BUDGETS if args.limit else None)
+    dt = 1000 / mode_rate(args.render)
+
+    with Recorder(args.record, len(boat.frame), args.record_format) as recorder:
+        for ix in range(args.frames):
+            boat.update(dt)
+            recorder.write(pipeline.apply(boat.strands), ix * dt / 1000)
+    print(f"Rendered {args.frames} frames of {args.render!r} to {args.record}")
+
+# Plays a recording back.  All the work was done when it was recorded so this
+# just copies frames into the OPC packet on time.
+def replay(args):
+    recording = Recording(args.replay)
+    address = f'{args.host}:{args.port}'
+
+    # Recordings of the whole boat get split up between the controllers the
+    # same as live.  Anything else goes to --host as is.
+    client = None
+    if args.dry_run:
+        pass
+    elif recording.pixel_count == STRAND_COUNT * STRAND_LENGTH:
+        client = FanOut(LAYOUT.controllers, address, args.output_rate, verbose=args.verbose)
+    else:
+        client = OpcWriter(address, recording.pixel_count, verbose=args.verbose)
+    print(f"Replaying {len(recording)} frames ({recording.duration:0.1f}s) from {args.replay}")
+
+    try:
+        while True:
+            start = time.monotonic()
+            for t, frame in recording:
+                delay = start + t - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if client:
+                    client.put_pixels(frame)
+                    if not TEMPORAL_DITHERING:
+                        client.put_pixels(frame)
+            if not args.loop:
+                break
+    except KeyboardInterrupt:
+        pass
+
+    if client:
+        client.put_pixels(numpy.zeros((recording.pixel_count, 3), dtype=numpy.uint8))
+
 if __name__ == '__main__':
-    main(parse_args())
+    args = parse_args()
+    if args.bench:
+        import bench
+        bench.run(args)
+    elif args.render:
+        render(args)
+    elif args.replay:
+        replay(args)
+    else:
+        main(args)
 
@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+import zipfile
+import tempfile
+
+import numpy
+
+# Anything that is slow(ish) to work out at startup and only depends on a few
+# settings gets saved here.  Safe to delete, it'll just get rebuilt.
+CACHE_DIR = './cache'
+
+def cache_path(name, key, ext='.npz'):
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f'{name}-{digest}{ext}')
+
+# Returns the dict of arrays saved under name/key, or builds (and saves) it
+# if there isn't one.  key is anything JSON can dump, change it whenever what
+# build() makes would change.
+def cached_arrays(name, key, build):
+    path = cache_path(name, key)
+    try:
+        with numpy.load(path) as data:
+            return {array: data[array] for array in data.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        pass
+
+    arrays = build()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass    # Read only SD card or similar.  Not the end of the world.
+    return arrays
+
+# Same idea for a blob of bytes (decoded sounds and the like).  Returns the
+# file memory mapped as a uint8 array, or the bytes build() made if the cache
+# can't be written.
+def cached_bytes(name, key, build, ext='.bin'):
+    path = cache_path(name, key, ext)
+    try:
+        return numpy.memmap(path, dtype=numpy.uint8, mode='r')
+    except (OSError, ValueError):   # Missing or empty
+        pass
+
+    data = build()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        return numpy.memmap(path, dtype=numpy.uint8, mode='r')
+    except (OSError, ValueError):
+        return numpy.frombuffer(data, dtype=numpy.uint8)
+
+# And again for things too big to have in memory even once (an hour of
+# decoded music).  write(f) puts it straight into an open file and what comes
+# back is always a memory map.  If the cache can't be written it goes in an
+# unnamed temporary file instead, which disappears once nothing maps it.
+def cached_file(name, key, write, ext='.bin'):
+    path = cache_path(name, key, ext)
+    try:
+        return numpy.memmap(path, dtype=numpy.uint8, mode='r')
+    except (OSError, ValueError):   # Missing or empty
+        pass
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        f = open(path + '.tmp', 'wb')
+    except OSError:
+        f = tempfile.TemporaryFile()
+        path = None
+
+    with f:
+        try:
+            write(f)
+            f.flush()
+        except BaseException:
+            if path is not None:
+                os.remove(path + '.tmp')
+            raise
+        if path is None:
+            return map_file(f)
+    os.replace(path + '.tmp', path)
+    return map_file(path)
+
+# numpy can't map an empty file
+def map_file(file):
+    try:
+        return numpy.memmap(file, dtype=numpy.uint8, mode='r')
+    except ValueError:
+        return numpy.zeros(0, dtype=numpy.uint8)
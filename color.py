@@ -0,0 +1,103 @@
+import numpy
+
+# Roughly what one LED draws at full white, in mA.  About 20 mA a channel
+# for the usual WS2812 type pixels.
+LED_CURRENT = 60
+
+# The power limiter nudges its scale a little every frame.  Rebuilding the
+# tables for changes smaller than this (half an output level) would be a
+# waste of time, and within this of full brightness it's full brightness.
+LIMIT_STEP = 1 / 512
+
+# Everything between the frame buffer and the Fadecandy: master brightness,
+# per-strand current limits, the power limiter and (optionally) gamma.  All
+# of them get folded into a 256 entry lookup table per strand so the whole
+# lot costs one add and one gather per frame no matter how many are on.
+#
+# Note: fcserver already applies the gamma from config.json so you probably
+#       don't want to do it here as well.
+class ColorPipeline:
+    def __init__(self, strand_sizes, strand_length, brightness=1.0, gamma=None, budgets=None):
+        self.strand_sizes = strand_sizes
+        self._brightness = brightness
+        self._gamma = gamma
+        self._budgets = budgets
+        self._limit = 1.0
+
+        # Each pixel's offset into the flattened (strands x 256) table
+        strands = numpy.arange(len(strand_sizes) * strand_length) // strand_length
+        self.offsets = (strands * 256)[:, None]
+        self._index = numpy.zeros((len(strands), 3), dtype=numpy.intp)
+
+        self.build()
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        self._brightness = value
+        self.build()
+
+    @property
+    def gamma(self):
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, value):
+        self._gamma = value
+        self.build()
+
+    # Extra scale factor from the power limiter (see power.py)
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, value):
+        if value > 1.0 - LIMIT_STEP:
+            value = 1.0
+        if abs(value - self._limit) > LIMIT_STEP or (value == 1.0 and self._limit != 1.0):
+            self._limit = value
+            self.build()
+
+    @property
+    def budgets(self):
+        return self._budgets
+
+    @budgets.setter
+    def budgets(self, value):
+        self._budgets = value
+        self.build()
+
+    # Worst case (everything full white) scale factor for each strand that
+    # keeps it inside its current budget.
+    def strand_scales(self):
+        scales = numpy.ones(len(self.strand_sizes))
+        if self.budgets is None:
+            return scales
+
+        for ix, (size, budget) in enumerate(zip(self.strand_sizes, self.budgets)):
+            if budget is not None and size:
+                scales[ix] = min(1.0, budget / (size * LED_CURRENT))
+        return scales
+
+    def build(self, scales=None):
+        if scales is None:
+            scales = self.strand_scales()
+
+        levels = numpy.arange(256) / 255
+        if self.gamma:
+            levels = levels ** self.gamma
+
+        table = numpy.outer(scales * self.brightness * self.limit, levels) * 255
+        self.table = numpy.rint(table).astype(numpy.uint8).ravel()
+        self.identity = bool((self.table == numpy.tile(numpy.arange(256), len(scales))).all())
+
+    # Applies the table to the frame in place.
+    def apply(self, frame):
+        if not self.identity:
+            numpy.add(frame, self.offsets, out=self._index)
+            numpy.take(self.table, self._index, out=frame, mode='clip')
+        return frame
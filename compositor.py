@@ -0,0 +1,123 @@
+import numpy
+
+# How each layer gets combined with everything underneath it:
+#
+#   'alpha':    The layer covers what's below, except where it is black
+#               (off) which is see through.
+#   'add':      Adds to what's below.  Good for glows and streaks.
+#   'max':      Whichever is brighter, channel by channel.
+#   'multiply': Darkens what's below.  White leaves it alone.
+#
+# Opacity fades the whole layer in or out on top of that.
+BLENDS = ('alpha', 'add', 'max', 'multiply')
+
+# An effect drawn into its own buffer so it can go on top of the mode.
+class Layer:
+    def __init__(self, name, effect, size, blend='alpha', opacity=1.0):
+        if blend not in BLENDS:
+            raise ValueError(f"Unknown blend {blend!r}")
+        self.name = name
+        self.effect = effect
+        self.blend = blend
+        self.opacity = opacity
+        self.visible = False
+        self.pixels = numpy.zeros((size, 3), dtype=numpy.uint8)
+
+    # True if drawing this frame wouldn't change anything
+    def transparent(self):
+        if self.opacity <= 0:
+            return True
+        if self.blend == 'multiply':
+            return bool((self.pixels == 255).all())
+        return not self.pixels.any()
+
+# Stacks layers on top of the boat's frame buffer.  The mode keeps drawing
+# into the boat's own buffer (a lot of them pick up where the last frame
+# left off) and the layers get blended on top of a copy of it.  With no
+# layers showing the boat's buffer is used as is and nothing gets copied.
+class Compositor:
+    def __init__(self, size):
+        # One extra black row on the end for the strand padding, same as
+        # the boat's buffer.
+        self._buffer = numpy.zeros((size + 1, 3), dtype=numpy.uint8)
+        self.pixels = self._buffer[:size]
+        self.layers = []
+
+        # Scratch space so blending doesn't allocate every frame
+        self._src = numpy.zeros((size, 3), dtype=numpy.uint16)
+        self._dst = numpy.zeros((size, 3), dtype=numpy.uint16)
+        self._alpha = numpy.zeros((size, 1), dtype=numpy.uint16)
+        self._covered = numpy.zeros(size, dtype=bool)
+
+    def add(self, name, effect, blend='alpha', opacity=1.0):
+        layer = Layer(name, effect, len(self.pixels), blend, opacity)
+        self.layers.append(layer)
+        return layer
+
+    def __getitem__(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def show(self, name, visible=True):
+        layer = self[name]
+        if visible and not layer.visible:
+            layer.pixels[:] = 255 if layer.blend == 'multiply' else 0
+            layer.effect.start()
+        layer.visible = visible
+
+    def hide(self, name):
+        self.show(name, False)
+
+    # Draws the visible layers over base (which has the black row on the end)
+    # and returns the buffer that should go out: either base itself or the
+    # composited copy.
+    def render(self, base, t, dt):
+        out = None
+        for layer in self.layers:
+            if not layer.visible or layer.opacity <= 0:
+                continue
+            layer.effect.render(layer.pixels, t, dt)
+            if layer.transparent():
+                continue
+            if out is None:
+                out = self.pixels
+                out[:] = base[:len(out)]
+            self.blend(out, layer)
+        return base if out is None else self._buffer
+
+    def blend(self, out, layer):
+        src = self._src
+        dst = self._dst
+        opacity = int(round(min(layer.opacity, 1.0) * 256))
+
+        if layer.blend == 'alpha':
+            # (out * (256 - a) + pixels * a) / 256 with a = 0 where it's black
+            layer.pixels.any(axis=1, out=self._covered)
+            numpy.multiply(self._covered, opacity, out=self._alpha[:, 0], dtype=numpy.uint16)
+            numpy.subtract(256, self._alpha, out=src)
+            numpy.multiply(out, src, out=dst)
+            numpy.multiply(layer.pixels, self._alpha, out=src)
+            dst += src
+            dst >>= 8
+        elif layer.blend == 'multiply':
+            # The opacity fades the layer towards white, not black
+            numpy.subtract(255, layer.pixels, out=src, dtype=numpy.uint16)
+            src *= opacity
+            src >>= 8
+            numpy.subtract(255, src, out=src)
+            numpy.multiply(out, src, out=dst)
+            dst //= 255
+        else:
+            numpy.multiply(layer.pixels, opacity, out=src, dtype=numpy.uint16)
+            src >>= 8
+            if layer.blend == 'add':
+                numpy.add(out, src, out=dst)
+                numpy.minimum(dst, 255, out=dst)
+            else:
+                numpy.maximum(out, src, out=dst)
+        out[:] = dst
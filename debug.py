@@ -2,7 +2,7 @@ import argparse
 
 from pprint import pprint
 
-import opc
+from output import OpcWriter
 
 STRANDS = 5
 LENGTH  = 60
@@ -10,6 +10,8 @@ LENGTH  = 60
 def parse_args():
     parser = argparse.ArgumentParser(description='Test Individual LEDs')
     parser.add_argument('-s', '--set', type=int, nargs=3, metavar='VAL', help='Set [STRAND] [LED] to [VALUE]')
+    parser.add_argument('-a', '--address', default='localhost:7890',
+                        help='OPC server (host:port) to test, for boats with more than one controller')
     args = parser.parse_args()
 
     return args
@@ -36,7 +38,7 @@ def get_number(prompt, low, high):
 
 
 def main(args):
-    client = opc.Client('localhost:7890')
+    client = OpcWriter(args.address, STRANDS * LENGTH)
     strands = [[(0, 0, 0)] * LENGTH for _ in range(STRANDS)]
 
     def display(strand, led, value):
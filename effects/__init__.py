@@ -0,0 +1,85 @@
+import os
+import pkgutil
+import importlib
+import importlib.util
+
+# All of the LED animations (modes) are effects.  Each one is a class that
+# registers itself under one or more mode names and draws into a frame buffer
+# with render().  Every module in this directory gets loaded at startup and
+# more can be loaded from anywhere else with load_plugins().
+#
+# mode name -> Effect class
+REGISTRY = dict()
+
+# Effects that go on top of a mode (see compositor.py) rather than being one.
+OVERLAYS = dict()
+
+def register(*names, registry=REGISTRY):
+    def decorator(cls):
+        for name in names:
+            registry[name] = cls
+        return cls
+    return decorator
+
+def overlay(*names):
+    return register(*names, registry=OVERLAYS)
+
+class Effect:
+    # Frame rate for modes that aren't in boat.RATES, any extra keys
+    # (pygame.K_*) that should select the mode and the overlays that get
+    # turned on with it.
+    rate = 20
+    keys = ()
+    layers = ()
+
+    def __init__(self, boat):
+        self.boat = boat
+        self._views = (None, None)
+
+        # Where the waves, the Larson scanner and the rail speckles are up
+        # to (see Boat.next_wave() and Boat.next_speckles()).  Each effect
+        # has its own so the old mode doesn't move the new one's along too
+        # while they cross-fade.
+        self.wave_offset = 0.0
+        self.kitt_pos = 0
+        self.kitt_dir = 1
+        self.speckles = []
+
+    # Named views (wave_left, rails, kitt, ...) into whatever frame we've
+    # been handed.  Worked out once per frame buffer, not every frame.
+    def views(self, frame):
+        if self._views[0] is not frame:
+            self._views = (frame, self.boat.views(frame))
+        return self._views[1]
+
+    # Called every time the effect becomes the current mode.
+    def start(self):
+        pass
+
+    # Called when it's been switched away from and has finished fading out,
+    # so nothing is drawing it any more.
+    def stop(self):
+        pass
+
+    # Draw into frame (an (N, 3) uint8 array laid out like Boat.pixels).  t is
+    # the time since the boat started and dt the time since the last frame,
+    # both in seconds.
+    def render(self, frame, t, dt):
+        raise NotImplementedError
+
+def create(name, boat, registry=REGISTRY):
+    return registry[name](boat)
+
+def load_plugins(path, package=None):
+    for info in pkgutil.iter_modules([path]):
+        if info.name.startswith('_'):
+            continue
+        if package:
+            importlib.import_module(f'{package}.{info.name}')
+        else:
+            spec = importlib.util.spec_from_file_location(f'effect_{info.name}',
+                                                          os.path.join(path, f'{info.name}.py'))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+load_plugins(os.path.dirname(__file__), __name__)
@@ -0,0 +1,48 @@
+import numpy
+
+from effects import Effect, register
+from geometry import RAIL_SIZE, KITT_SIZE
+
+# This routine was used for the Rose, White, and Blue parade.  Unfortunatly:
+# (a) The parade was in full daylight and no one could see the LEDs
+# (b) The white stripes were on the wrong side of the boat.
+@register('america')
+class America(Effect):
+    def __init__(self, boat):
+        super().__init__(boat)
+        self.usa = [(255, 0, 0), (255, 255, 255), (0, 0, 255)]
+
+    def render(self, frame, t, dt):
+        boat = self.boat
+        strips = self.views(frame)
+
+        # Animate the waves
+        d_color = 5
+        step = numpy.clip(numpy.array(self.usa[0], dtype=numpy.int16) - strips.waves, -d_color, d_color)
+        if step.any():
+            strips.waves[:] = strips.waves + step
+        else:
+            self.usa = self.usa[1:] + [self.usa[0]]
+
+        # Animate Larson scanner
+        self.kitt_pos += self.kitt_dir
+        if (self.kitt_pos < 1) or (self.kitt_pos > (KITT_SIZE - 2) * 2):
+            edge = strips.rail_left if self.kitt_pos < 1 else strips.rail_right
+            edge[RAIL_SIZE - KITT_SIZE - 6:RAIL_SIZE - KITT_SIZE] = (255, 255, 255)
+            self.kitt_dir *= -1
+            self.kitt_pos += self.kitt_dir
+        else:
+            strips.rail_left[RAIL_SIZE - KITT_SIZE - 1] = (255, 0, 0)
+            strips.rail_right[RAIL_SIZE - KITT_SIZE - 1] = (0, 0, 255)
+
+        strips.kitt[:] = boat.kitt_dark
+        strips.kitt[self.kitt_pos:self.kitt_pos + boat.kitt_size] = (255, 255, 255)
+        half = self.kitt_pos + boat.kitt_size if self.kitt_dir == 1 else self.kitt_pos - 1
+        strips.kitt[half] = (192, 192, 192)
+
+        # Pull the white stripes along the rails
+        strips.rail_left[:-1] = strips.rail_left[1:]
+        strips.rail_right[:-1] = strips.rail_right[1:]
+
+        strips.nacelle_left[:] = boat.nacelles()
+        strips.nacelle_right[:] = strips.nacelle_left
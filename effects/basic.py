@@ -0,0 +1,21 @@
+from effects import Effect, register
+
+# Does nothing so whatever you clicked on stays put.
+@register('debug')
+class Debug(Effect):
+    def render(self, frame, t, dt):
+        pass
+
+# Added this after figuring out that there was no way to turn off the
+# lights except to unplug the LED power supply or the Pi.
+@register('off')
+class Off(Effect):
+    def render(self, frame, t, dt):
+        frame[:] = 0
+
+# Turn on all of the LEDs to full power.  Great for debugging and setting
+# the poop deck on fire.
+@register('bright')
+class Bright(Effect):
+    def render(self, frame, t, dt):
+        frame[:] = 255
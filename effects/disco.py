@@ -0,0 +1,27 @@
+import numpy
+
+from effects import Effect, register
+
+@register('disco', 'panic')
+class Disco(Effect):
+    low = 0
+    high = 255
+
+    def render(self, frame, t, dt):
+        frame[:] = self.boat.rng.integers(self.low, self.high, size=frame.shape,
+                                          dtype=numpy.uint8, endpoint=True)
+
+@register('slow')
+class Slow(Disco):
+    #low = 128  # Too pastel
+    hold = 5
+
+    def start(self):
+        self.delay = 0
+
+    def render(self, frame, t, dt):
+        if self.delay == 0:
+            super().render(frame, t, dt)
+            self.delay = self.hold
+        else:
+            self.delay -= 1
@@ -0,0 +1,60 @@
+import math
+
+import numpy
+import pygame
+
+import audio
+from effects import Effect, register
+
+# How quickly the beat flash dies away (seconds)
+FLASH_TIME = 0.15
+
+# Lights that follow the music (see audio.py).  The bass moves the waves,
+# the mids fill the rails up from the stern like a VU meter, the treble
+# brightens the nacelles and the beats flash the bow.  Without anything
+# to listen to (boat.audio is None) it all sits at the quiet end.
+@register('music')
+class Music(Effect):
+    rate = 50
+    keys = (pygame.K_KP_DIVIDE, pygame.K_m)
+
+    def start(self):
+        self.beats = None
+        self.flash = 0.0
+        if self.boat.audio is not None:
+            self.boat.audio.resume()
+
+    # No point working out the levels when nobody is looking at them
+    def stop(self):
+        if self.boat.audio is not None:
+            self.boat.audio.pause()
+
+    def render(self, frame, t, dt):
+        boat = self.boat
+        strips = self.views(frame)
+        levels = boat.audio.levels if boat.audio is not None else audio.SILENCE
+        bands = levels.bands
+        bass = bands[:2].max()
+        mids = bands[2:4].mean()
+        treble = bands[4:].mean()
+
+        self.flash *= math.exp(-dt / FLASH_TIME)
+        if self.beats is not None and levels.beats != self.beats:
+            self.flash = 1.0
+        self.beats = levels.beats
+
+        # The usual waves, brighter with more bass and washed out on a beat
+        waves = boat.next_wave(self) * (0.15 + 0.85 * bass) + 96 * self.flash
+        strips.wave_left[:] = numpy.minimum(waves, 255)
+        strips.wave_right[:] = strips.wave_left
+
+        lit = int(round(mids * len(strips.rail_left)))
+        color = (int(255 * self.flash), int(64 + 191 * mids), 255)
+        for rail in (strips.rail_left, strips.rail_right):
+            rail[:] = 24
+            rail[:lit] = color
+
+        strips.kitt[:] = (int(64 + 191 * self.flash), 0, 0)
+
+        strips.nacelle_left[:] = boat.nacelles() * (0.25 + 0.75 * treble)
+        strips.nacelle_right[:] = strips.nacelle_left
@@ -0,0 +1,63 @@
+import math
+
+import numpy
+
+from effects import Effect, overlay
+from geometry import RAIL_SIZE, KITT_SIZE, STERN_SIZE, NOSE_SIZE
+
+# Red alert pulses per second
+ALERT_RATE = 1.0
+
+# Warp streaks: how fast they run down the rails (LEDs per second), how many
+# start on each rail per second and how quickly their tails fade (the tail
+# loses 1/2**WARP_FADE of its brightness every frame).
+WARP_SPEED = 150
+WARP_STREAKS = 6
+WARP_FADE = 2
+WARP_COLOR = (160, 200, 255)
+
+# Add indicators:
+#       Add collision lights on the corners of the boat.  Red on the left
+#       and green on the right.
+@overlay('nav_lights')
+class NavLights(Effect):
+    def render(self, frame, t, dt):
+        strips = self.views(frame)
+        for starboard, rail in enumerate([strips.rail_left, strips.rail_right]):
+            color = (0, 255, 0) if starboard else (255, 0, 0)  # Good port wine is red
+            rail[STERN_SIZE:STERN_SIZE+3] = color
+            rail[RAIL_SIZE-NOSE_SIZE-2:RAIL_SIZE-NOSE_SIZE+1] = color
+
+# Goes with the red alert klaxon.  The bow goes solid red and the rails
+# pulse red over whatever the mode is doing.
+@overlay('red_alert')
+class RedAlert(Effect):
+    def start(self):
+        self.elapsed = 0.0
+
+    def render(self, frame, t, dt):
+        strips = self.views(frame)
+        self.elapsed += dt
+        level = 0.5 - 0.5 * math.cos(2 * math.pi * self.elapsed * ALERT_RATE)
+        strips.rails[:] = (int(255 * level), 0, 0)
+        strips.kitt[:] = (255, 0, 0)
+
+# Streaks of light running from the bow to the stern while we're at warp.
+@overlay('warp')
+class Warp(Effect):
+    def start(self):
+        self.heads = [numpy.zeros(0), numpy.zeros(0)]
+
+    def render(self, frame, t, dt):
+        strips = self.views(frame)
+        frame -= frame >> WARP_FADE
+
+        bow = RAIL_SIZE - KITT_SIZE - 1
+        new = self.boat.overlay_rng.random(len(self.heads)) < WARP_STREAKS * dt
+        for ix, (rail, heads) in enumerate(zip((strips.rail_left, strips.rail_right), self.heads)):
+            heads = heads - WARP_SPEED * dt
+            if new[ix]:
+                heads = numpy.append(heads, bow)
+            heads = heads[heads >= 0]
+            rail[heads.astype(numpy.intp)] = WARP_COLOR
+            self.heads[ix] = heads
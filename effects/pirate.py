@@ -0,0 +1,64 @@
+import numpy
+
+from effects import Effect, register
+from geometry import KITT_SIZE
+
+# The pirate ship LED routines.  fast_boat and speed_boat are the regular
+# boat, just run at a higher frame rate.  The collision lights are an
+# overlay (see overlays.py).
+@register('boat', 'fast_boat', 'speed_boat')
+class Pirate(Effect):
+    in_space = False
+    layers = ('nav_lights',)
+
+    def render(self, frame, t, dt):
+        boat = self.boat
+        strips = self.views(frame)
+
+        # Animate the waves:
+        #       Remember the old biorythm BASIC programs you could type
+        #       in from a computer magazine.  This is basically that only
+        #       without the cheat code where my cirthday was always the 
+        #       best one.  Makes a scrolling sin wave with a smaller sine
+        #       wave (noise) on top.  The waves are in shades of blue with
+        #       peaks in pure white (chop)
+        strips.wave_left[:] = boat.next_wave(self)
+        strips.wave_right[:] = strips.wave_left
+
+        # Update speckles:
+        #       The rails are solid grey but have spots to break up the
+        #       monotony. The spots fade to grey over time.
+        target = boat.rail_level[0]
+        level = strips.rails[:, 0].astype(numpy.int16)
+        fading = level != target
+        level = numpy.maximum(target, level - boat.rail_decay)
+        strips.rails[fading] = level[fading, None]
+
+        for rail, dot in zip((strips.rail_left, strips.rail_right), boat.next_speckles(self)):
+            if dot:
+                rail[dot] = (255, 255, 255)
+                rail[dot-1] = (200, 200, 200)
+                rail[dot+1] = (200, 200, 200)
+
+        # The enterprise doesn't get the KITT-esque Larson scanner
+        if not self.in_space:
+            self.kitt_pos += self.kitt_dir
+            if (self.kitt_pos < 1) or (self.kitt_pos > (KITT_SIZE - 2) * 2):
+                self.kitt_dir *= -1
+                self.kitt_pos += self.kitt_dir
+            strips.kitt[:] = boat.kitt_dark
+            strips.kitt[self.kitt_pos:self.kitt_pos + boat.kitt_size] = (255, 0, 0)
+            half = self.kitt_pos + boat.kitt_size if self.kitt_dir == 1 else self.kitt_pos - 1
+            strips.kitt[half] = (192, 0, 0)
+        else:
+            strips.kitt[:] = (255, 255, 255)    # Red alert is an overlay now
+
+        # Rotate the LEDs in the nacelles.  If the motor and slipring had worked
+        # this would have been done in hardware.
+        strips.nacelle_left[:] = boat.nacelles()
+        strips.nacelle_right[:] = strips.nacelle_left
+
+# The enterprise LED routines.
+@register('space')
+class Space(Pirate):
+    in_space = True
@@ -0,0 +1,104 @@
+import sys
+import time
+import argparse
+import threading
+import socketserver
+
+from output import OPC_HEADER_SIZE
+
+# A pretend OPC server (fcserver) for testing the output without any LEDs.
+# It reads the messages, counts them and prints how many it got every
+# second.  It can also be slow (--delay) so the socket buffers fill up, or
+# hang up every so often (--restart) like fcserver being restarted.
+#
+#   python fake_opc.py --port 7890 7891
+#   python boat.py --headless --host localhost
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fake OPC server for testing')
+    parser.add_argument('-p', '--port', type=int, nargs='+', default=[7890],
+                        help='Port(s) to listen on, one per controller')
+    parser.add_argument('-d', '--delay', type=float, default=0.0,
+                        help='Seconds to sleep after every message (a slow server)')
+    parser.add_argument('-r', '--restart', type=int, default=0,
+                        help='Hang up after this many messages (fcserver restarting)')
+    return parser.parse_args()
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = dict()
+        self.pixels = dict()
+
+    def add(self, port, channel, length):
+        with self.lock:
+            key = (port, channel)
+            self.messages[key] = self.messages.get(key, 0) + 1
+            self.pixels[key] = length // 3
+
+    # The counts since last time
+    def take(self):
+        with self.lock:
+            messages, self.messages = self.messages, dict()
+            return messages, dict(self.pixels)
+
+class Handler(socketserver.BaseRequestHandler):
+    def recv_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self):
+        server = self.server
+        port = server.server_address[1]
+        print(f"{port}: Connection from {self.client_address[0]}:{self.client_address[1]}", flush=True)
+
+        count = 0
+        while True:
+            header = self.recv_exactly(OPC_HEADER_SIZE)
+            if header is None:
+                break
+            channel, command, high, low = header
+            length = (high << 8) | low
+            if self.recv_exactly(length) is None:
+                break
+            server.stats.add(port, channel, length)
+
+            count += 1
+            if server.delay:
+                time.sleep(server.delay)
+            if server.restart and count >= server.restart:
+                print(f"{port}: Hanging up after {count} messages", flush=True)
+                break
+        print(f"{port}: Disconnected", flush=True)
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def main(args):
+    stats = Stats()
+    for port in args.port:
+        server = Server(('', port), Handler)
+        server.stats = stats
+        server.delay = args.delay
+        server.restart = args.restart
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Listening on {port}", flush=True)
+
+    while True:
+        time.sleep(1.0)
+        messages, pixels = stats.take()
+        if messages:
+            print(', '.join(f"{port}/{channel}: {count} fps ({pixels[port, channel]} pixels)"
+                            for (port, channel), count in sorted(messages.items())), flush=True)
+
+if __name__ == '__main__':
+    try:
+        main(parse_args())
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,172 @@
+import os
+import json
+import collections
+
+import numpy
+
+from cache import cached_arrays
+
+# Where every LED on the ship is lives in layout.json rather than in code.
+# The ship is made of strips (what the animations see, e.g. 'rail_left')
+# and each strip is one or more segments in a row.  Each segment says:
+#
+#   length:         How many LEDs
+#   strand/offset:  Where the first one is on the FadeCandy
+#   reverse:        true if the strand runs the other way from the strip
+#   screen:         Where they go in the simulator, as [x, y, dx, dy, count]
+#                   runs in LEDs (not pixels) from the top left
+#   name:           Optional, so a part of a strip can be found
+#
+# "controllers" say which strands go to which FadeCandy (or other OPC
+# server) and on what OPC channel.  An address of null means whatever was
+# given with --host and --port.  Without any, every strand goes to the one
+# on the command line.  With "per_strand" each strand is sent as its own OPC
+# message, the first on "channel", the next on channel + 1 and so on (set up
+# fcserver's map to match), so only the strands that changed need sending.
+#
+# "marks" are any other numbers the animations want to know.  It all gets
+# compiled into the arrays that the rest of the code uses (and cached, so
+# it's only done when the file changes).
+LAYOUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layout.json')
+LAYOUT_VERSION = 3
+
+# start/end are in pixels of the full (all strands) frame.  strand_length is
+# 0 unless each strand goes in its own message.
+Controller = collections.namedtuple('Controller', 'name address channel start end strand_length')
+
+# [x, y, dx, dy, count] runs -> (LEDs, 2) positions
+def run_positions(runs):
+    positions = []
+    for x, y, dx, dy, count in runs:
+        steps = numpy.arange(count)[:, None]
+        positions.append(numpy.array([x, y]) + steps * numpy.array([dx, dy]))
+    return numpy.concatenate(positions) if positions else numpy.zeros((0, 2), dtype=int)
+
+def compile_layout(path):
+    with open(path) as f:
+        layout = json.load(f)
+    strand_count = layout['strand_count']
+    strand_length = layout['strand_length']
+
+    # Strips go into the frame buffer in the order they first show up
+    strips = dict()
+    for segment in layout['segments']:
+        strips.setdefault(segment['strip'], []).append(segment)
+    size = sum(segment['length'] for segment in layout['segments'])
+
+    bounds = []
+    parts = dict()
+    positions = numpy.zeros((size, 2), dtype=numpy.int32)
+    strand_map = numpy.full(strand_count * strand_length, size, dtype=numpy.intp)
+    start = 0
+    for name, segments in strips.items():
+        strip_start = start
+        for segment in segments:
+            length = segment['length']
+            where = f"{path}: {name} segment at {start - strip_start}"
+            screen = run_positions(segment['screen'])
+            if len(screen) != length:
+                raise ValueError(f"{where} has {len(screen)} screen positions for {length} LEDs")
+            if not 0 <= segment['strand'] < strand_count:
+                raise ValueError(f"{where} is on strand {segment['strand']} (only {strand_count})")
+            if not 0 <= segment['offset'] <= strand_length - length:
+                raise ValueError(f"{where} doesn't fit on its strand")
+
+            pixels = numpy.arange(start, start + length)
+            if segment.get('reverse', False):
+                pixels = pixels[::-1]
+            slots = slice(segment['strand'] * strand_length + segment['offset'],
+                          segment['strand'] * strand_length + segment['offset'] + length)
+            if (strand_map[slots] != size).any():
+                raise ValueError(f"{where} overlaps another segment on strand {segment['strand']}")
+            strand_map[slots] = pixels
+
+            positions[start:start + length] = screen
+            if 'name' in segment:
+                parts[segment['name']] = (start, start + length)
+            start += length
+        bounds.append((strip_start, start))
+
+    controllers = layout.get('controllers', [dict(name='fadecandy', strands=[0, strand_count])])
+    taken = numpy.zeros(strand_count, dtype=bool)
+    for controller in controllers:
+        first, count = controller['strands']
+        if first < 0 or first + count > strand_count or taken[first:first + count].any():
+            raise ValueError(f"{path}: controller {controller['name']} has bad strands {controller['strands']}")
+        if not 0 <= controller.get('channel', 0) + (count if controller.get('per_strand') else 1) <= 256:
+            raise ValueError(f"{path}: controller {controller['name']} has a bad channel")
+        taken[first:first + count] = True
+
+    marks = layout.get('marks', dict())
+    return dict(controllers=numpy.array([controller['name'] for controller in controllers]),
+                addresses=numpy.array([controller.get('address') or '' for controller in controllers]),
+                controller_strands=numpy.array([[controller.get('channel', 0), *controller['strands'],
+                                                 controller.get('per_strand', False)]
+                                                for controller in controllers]),
+                strips=numpy.array(list(strips)), bounds=numpy.array(bounds).reshape(-1, 2),
+                parts=numpy.array(list(parts)), part_bounds=numpy.array(list(parts.values())).reshape(-1, 2),
+                marks=numpy.array(list(marks)), mark_values=numpy.array(list(marks.values())),
+                shape=numpy.array([strand_count, strand_length]), screen=numpy.array(layout['screen']),
+                strand_map=strand_map, positions=positions)
+
+# The compiled layout.
+#
+#   strips:     name -> (start, end) in the frame buffer
+#   parts:      name -> (start, end) for the named segments
+#   strand_map: For each FadeCandy pixel, which LED it shows (size for none)
+#   positions:  (x, y) of every LED on the screen, in LEDs
+#   controllers: Where each part of the frame gets sent (Controller tuples)
+class Layout:
+    def __init__(self, arrays):
+        self.strips = {str(name): (int(start), int(end)) for name, (start, end) in zip(arrays['strips'], arrays['bounds'])}
+        self.parts = {str(name): (int(start), int(end)) for name, (start, end) in zip(arrays['parts'], arrays['part_bounds'])}
+        self.marks = {str(name): int(value) for name, value in zip(arrays['marks'], arrays['mark_values'])}
+        self.strand_count, self.strand_length = (int(n) for n in arrays['shape'])
+        self.screen = tuple(int(n) for n in arrays['screen'])
+        self.strand_map = arrays['strand_map']
+        self.positions = arrays['positions']
+        self.size = len(self.positions)
+
+        self.controllers = []
+        for name, address, (channel, first, count, per_strand) in zip(arrays['controllers'], arrays['addresses'],
+                                                                      arrays['controller_strands']):
+            self.controllers.append(Controller(str(name), str(address) or None, int(channel),
+                                               int(first) * self.strand_length,
+                                               int(first + count) * self.strand_length,
+                                               self.strand_length if per_strand else 0))
+
+    def length(self, name):
+        start, end = self.strips[name] if name in self.strips else self.parts[name]
+        return end - start
+
+    # (x, y, w, h) in pixels of every LED when they're size pixels with gap
+    # between them.
+    def rects(self, size, gap):
+        rects = numpy.zeros((self.size, 4), dtype=numpy.int32)
+        rects[:, :2] = self.positions * (size + gap)
+        rects[:, 2:] = size
+        return rects
+
+def load_layout(path=LAYOUT_FILE):
+    stat = os.stat(path)
+    key = dict(path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns, version=LAYOUT_VERSION)
+    return Layout(cached_arrays('layout', key, lambda: compile_layout(path)))
+
+LAYOUT = load_layout()
+
+# What the FadeCandy actually sees: 8 strands of 64 pixels each.
+STRAND_COUNT = LAYOUT.strand_count
+STRAND_LENGTH = LAYOUT.strand_length
+
+# This is the number of LEDs in each element of the boat. Doesn't directly
+# map to the LED positions on the fade candy.
+#
+# These are here (rather than in boat.py) so the effects can get at them.
+KITT_SIZE = LAYOUT.length('kitt') // 2
+RAIL_SIZE = LAYOUT.length('rail_left') + KITT_SIZE
+STERN_SIZE = LAYOUT.marks['stern']
+NOSE_SIZE = LAYOUT.marks['nose']
+WAVE_SIZE = LAYOUT.length('wave_left')
+PROW = RAIL_SIZE - NOSE_SIZE
+SPINNER_SIZE = LAYOUT.length('spinner_left')
+TAIL_SIZE = LAYOUT.length('tail_left')
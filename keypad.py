@@ -0,0 +1,141 @@
+import sys
+import atexit
+import select
+import threading
+
+import pygame
+
+# evdev is only needed to read the USB keypad directly when there's no
+# display.  Linux only, so don't make it a hard requirement.
+try:
+    import evdev
+except ImportError:
+    evdev = None
+
+# Without a window pygame never sees the keyboard so these readers pick up
+# the keys some other way and post them to the pygame event queue as regular
+# KEYDOWN events.  That way main() doesn't need to know the difference.
+def post_key(key, unicode=''):
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key, unicode=unicode, mod=0))
+
+# Characters typed on stdin that don't map straight to a pygame key.
+STDIN_KEYS = {'+': pygame.K_KP_PLUS,
+              '-': pygame.K_KP_MINUS,
+              '.': pygame.K_KP_PERIOD,
+              '*': pygame.K_KP_MULTIPLY,
+              '/': pygame.K_KP_DIVIDE,
+              '\x1b': pygame.K_ESCAPE,
+             }
+
+def build_evdev_keys():
+    keys = {'KEY_KPPLUS': (pygame.K_KP_PLUS, '+'),
+            'KEY_KPMINUS': (pygame.K_KP_MINUS, '-'),
+            'KEY_KPDOT': (pygame.K_KP_PERIOD, '.'),
+            'KEY_KPASTERISK': (pygame.K_KP_MULTIPLY, '*'),
+            'KEY_KPSLASH': (pygame.K_KP_DIVIDE, '/'),
+            'KEY_GRAVE': (pygame.K_BACKQUOTE, '`'),
+            'KEY_ESC': (pygame.K_ESCAPE, '\x1b'),
+           }
+    for digit in '0123456789':
+        keys[f'KEY_KP{digit}'] = (getattr(pygame, f'K_KP{digit}'), digit)
+        keys[f'KEY_{digit}'] = (ord(digit), digit)
+    for letter in 'abcdefghijklmnopqrstuvwxyz':
+        keys[f'KEY_{letter.upper()}'] = (ord(letter), letter)
+
+    return {evdev.ecodes.ecodes[name]: key for name, key in keys.items()}
+
+# Reads keys straight from the keyboards (the mode keypad glued in the poop
+# deck and the hidden sound effects keyboard), all of them at once.  One
+# getting unplugged doesn't stop the others.
+class EvdevReader(threading.Thread):
+    def __init__(self, paths=None):
+        super().__init__(name='evdev-keys', daemon=True)
+        self.keys = build_evdev_keys()
+        self.devices = [evdev.InputDevice(path) for path in paths] if paths else find_keyboards(self.keys)
+        if not self.devices:
+            raise OSError("No keyboard found")
+
+    def run(self):
+        for device in self.devices:
+            try:
+                device.grab()  # Don't let the keys leak through to the console
+            except OSError:
+                pass
+
+        devices = {device.fd: device for device in self.devices}
+        while devices:
+            ready, _, _ = select.select(list(devices), [], [])
+            for fd in ready:
+                try:
+                    events = list(devices[fd].read())
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    print(f"Lost keyboard {devices.pop(fd).path}: {e}", file=sys.stderr)
+                    continue
+                for event in events:
+                    if event.type == evdev.ecodes.EV_KEY and event.value == 1 and event.code in self.keys:
+                        post_key(*self.keys[event.code])
+
+# Every device with any of the keys we use.  Leaves out mice, the power
+# button and the like.
+def find_keyboards(keys):
+    found = []
+    for path in evdev.list_devices():
+        device = evdev.InputDevice(path)
+        codes = device.capabilities().get(evdev.ecodes.EV_KEY, [])
+        if any(code in keys for code in codes):
+            found.append(device)
+        else:
+            device.close()
+    return found
+
+# Reads single key presses from the terminal.  Handy over ssh.
+#
+# Ctrl-D at a terminal quits (the terminal is in cbreak mode so it turns
+# up as a '\x04' rather than the end of the input).  Running from a service
+# (or a script) stdin is usually /dev/null and ends straight away, which
+# just means there are no keys to read, so the reader stops and the show
+# carries on.
+class StdinReader(threading.Thread):
+    def __init__(self, stream=sys.stdin):
+        super().__init__(name='stdin-keys', daemon=True)
+        self.stream = stream
+
+    def run(self):
+        if self.stream.isatty():
+            import termios
+            import tty
+
+            fd = self.stream.fileno()
+            old = termios.tcgetattr(fd)
+            atexit.register(termios.tcsetattr, fd, termios.TCSADRAIN, old)
+            tty.setcbreak(fd)
+
+        while True:
+            char = self.stream.read(1)
+            if char == '\x04' or (not char and self.stream.isatty()):
+                pygame.event.post(pygame.event.Event(pygame.QUIT))
+                return
+            if not char:
+                return
+            if char in STDIN_KEYS:
+                post_key(STDIN_KEYS[char], char)
+            elif char.isprintable():
+                post_key(ord(char.lower()), char.lower())
+
+# Use the real keyboards if we can get at them, otherwise fall back to stdin.
+def start_reader(paths=None):
+    reader = None
+    if evdev is not None:
+        try:
+            reader = EvdevReader(paths)
+        except OSError as e:
+            print(f"Unable to open keyboard ({e}), reading keys from stdin", file=sys.stderr)
+    elif paths:
+        print("evdev not installed, reading keys from stdin", file=sys.stderr)
+
+    if reader is None:
+        reader = StdinReader()
+    reader.start()
+    return reader
@@ -0,0 +1,318 @@
+import sys
+import time
+import socket
+import threading
+
+import numpy
+
+from timing import FrameClock, StageTimer
+
+# Open Pixel Control bits and pieces.  See http://openpixelcontrol.org/
+OPC_SET_PIXELS = 0
+OPC_HEADER_SIZE = 4
+
+CONNECT_TIMEOUT = 1.0
+
+# A send that takes longer than this gives up and drops the connection (it
+# gets made again on the next frame).  Without it a controller that stops
+# reading would hang its output thread forever.
+SEND_TIMEOUT = 0.5
+
+# When the OPC server goes away (fcserver restarting, a cable pulled) don't
+# try to connect every frame, that's a CONNECT_TIMEOUT stall each time.
+# Wait RETRY_MIN seconds before the first go and double it after every
+# failure up to RETRY_MAX.
+RETRY_MIN = 0.1
+RETRY_MAX = 5.0
+
+# Frames that are the same as the last one sent aren't sent again, apart
+# from once every KEEPALIVE_TIME seconds.  That keeps the FadeCandy's
+# dithering and interpolation fed and puts back anything the controller lost
+# (a restart, say).  0 sends every frame.
+KEEPALIVE_TIME = 1.0
+
+# A drop-in replacement for opc.Client that doesn't rebuild the packet every
+# frame.  The packet (header and all) lives in one bytearray and `frame` is a
+# numpy (N, 3) view straight into the pixel payload.  Render into `frame` and
+# the packet is ready to go with a single sendall().
+#
+# Given a strand_length each strand goes out as its own message on channel,
+# channel + 1, ... instead, which lets send() leave out the ones that haven't
+# changed.
+class OpcWriter:
+    def __init__(self, address, pixel_count=512, channel=0, verbose=False, strand_length=0):
+        host, port = address.rsplit(':', 1)
+        self.host = host
+        self.port = int(port)
+        self.channel = channel
+        self.verbose = verbose
+
+        # Health, for the stats
+        self.connects = 0
+        self.failures = 0
+
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+
+        self.packet = bytearray(OPC_HEADER_SIZE + pixel_count * 3)
+        self.frame = numpy.frombuffer(self.packet, dtype=numpy.uint8,
+                                      offset=OPC_HEADER_SIZE).reshape(pixel_count, 3)
+        self._view = memoryview(self.packet)
+        self.set_header(channel)
+
+        self.strand_length = strand_length
+        self.strand_count = pixel_count // strand_length if strand_length else 1
+        if strand_length:
+            self._strand = bytearray(OPC_HEADER_SIZE + strand_length * 3)
+
+        self.socket = None
+
+    def set_header(self, channel=0, command=OPC_SET_PIXELS):
+        length = len(self.packet) - OPC_HEADER_SIZE
+        self.packet[:OPC_HEADER_SIZE] = bytes((channel, command, length >> 8, length & 0xFF))
+
+    def connect(self):
+        if self.socket is not None:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        except OSError as e:
+            if self.verbose:
+                print(f"OPC: Unable to connect to {self.host}:{self.port}: {e}", file=sys.stderr)
+            self.failures += 1
+            self.backoff()
+            return False
+
+        sock.settimeout(SEND_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket = sock
+        self.connects += 1
+        self.retry_delay = 0.0
+        if self.verbose and self.connects > 1:
+            print(f"OPC: Reconnected to {self.host}:{self.port}", file=sys.stderr)
+        return True
+
+    def backoff(self):
+        self.retry_delay = min(max(self.retry_delay * 2, RETRY_MIN), RETRY_MAX)
+        self.retry_at = time.monotonic() + self.retry_delay
+
+    @property
+    def connected(self):
+        return self.socket is not None
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    # Same name as opc.Client so nothing else has to change.
+    def can_connect(self):
+        return self.connect()
+
+    # Send whatever is currently sitting in the packet buffer.  strands picks
+    # which strands to send when they go separately (all of them if None).
+    def send(self, strands=None):
+        if not self.connect():
+            return False
+
+        try:
+            if self.strand_length:
+                self.send_strands(range(self.strand_count) if strands is None else strands)
+            else:
+                self.socket.sendall(self._view)
+        except OSError as e:
+            if self.verbose:
+                print(f"OPC: Send to {self.host}:{self.port} failed: {e}", file=sys.stderr)
+            self.failures += 1
+            self.disconnect()
+            self.backoff()
+            return False
+        return True
+
+    def send_strands(self, strands):
+        size = self.strand_length * 3
+        for ix in strands:
+            start = OPC_HEADER_SIZE + ix * size
+            self._strand[:OPC_HEADER_SIZE] = bytes((self.packet[0] + ix, OPC_SET_PIXELS, size >> 8, size & 0xFF))
+            self._strand[OPC_HEADER_SIZE:] = self._view[start:start + size]
+            self.socket.sendall(self._strand)
+
+    # Copies the pixels into the packet (unless they are already there) and
+    # sends it.  Accepts the same lists of (r, g, b) tuples as opc.Client.
+    def put_pixels(self, pixels, channel=None):
+        if channel is None:
+            channel = self.channel
+        if self.packet[0] != channel:
+            self.set_header(channel)
+
+        if pixels is not self.frame:
+            pixels = numpy.asarray(pixels)
+            if pixels.dtype != numpy.uint8:
+                pixels = numpy.clip(pixels, 0, 255)
+            count = min(len(pixels), len(self.frame))
+            self.frame[:count] = pixels[:count]
+            self.frame[count:] = 0
+
+        return self.send()
+
+
+# Pushes frames to the LEDs from its own thread so a slow display flip (or
+# anything else in the main loop) doesn't hold up the lights.
+#
+# The animation side calls publish() and never waits for a send.  Frames are
+# handed over in three buffers (triple buffering): publish() copies into its
+# own back buffer and then, under the lock, swaps it with the pending one.
+# The output thread swaps the pending buffer for its own front buffer the
+# same way when there's a new frame.  The lock is only held for the swaps,
+# never for a copy or a send, and nobody ever writes a buffer the other side
+# could be reading.  Only the newest frame is ever sent.  Anything older is
+# dropped, not queued, and so is anything that comes along while the OPC
+# server is down.
+#
+# A frame that's the same as the last one sent is skipped (see
+# KEEPALIVE_TIME) and when the strands go separately only the ones that
+# changed are sent.
+class OutputThread(threading.Thread):
+    def __init__(self, writer, fps, dithering=True, name='led-output', keepalive=KEEPALIVE_TIME):
+        super().__init__(name=name, daemon=True)
+        self.writer = writer
+        self.fps = fps
+        self.dithering = dithering
+        self.keepalive = keepalive
+
+        self._back = numpy.zeros_like(writer.frame)
+        self._pending = numpy.zeros_like(writer.frame)
+        self._front = numpy.zeros_like(writer.frame)
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.sent = 0
+        self.dropped = 0
+        self.skipped = 0
+
+        # What the controller has now, and when it last got everything
+        self.last_sent = numpy.zeros_like(writer.frame)
+        self.refreshed = 0.0
+        self._diff = numpy.zeros(writer.frame.shape, dtype=bool)
+        self.timer = StageTimer(('copy', 'send'))
+        self._stop_event = threading.Event()
+
+    def publish(self, frame):
+        numpy.copyto(self._back, frame)
+        with self._lock:
+            self._back, self._pending = self._pending, self._back
+            self.generation += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        clock = FrameClock(self.fps)
+        last = 0
+        while not self._stop_event.is_set():
+            clock.tick()
+
+            generation = self.generation
+            refresh = self.keepalive > 0 and time.monotonic() - self.refreshed >= self.keepalive
+            if generation == last and not refresh:
+                continue
+
+            self.timer.start()
+            if generation != last:
+                with self._lock:
+                    self._front, self._pending = self._pending, self._front
+                    generation = self.generation
+                numpy.copyto(self.writer.frame, self._front)
+                self.dropped += generation - last - 1
+                last = generation
+            self.timer.mark('copy')
+
+            strands = None
+            if not refresh and self.keepalive > 0:
+                strands = self.changed()
+                if not len(strands):
+                    self.skipped += 1
+                    continue
+
+            sent = self.writer.send(strands)
+            if sent and not self.dithering:
+                # Twice to defeat temporal dithering.
+                sent = self.writer.send(strands)
+            if sent:
+                numpy.copyto(self.last_sent, self.writer.frame)
+                if strands is None:
+                    self.refreshed = time.monotonic()
+                self.sent += 1
+            else:
+                # Everything goes again once it's back
+                self.refreshed = 0.0
+                self.dropped += 1
+            self.timer.mark('send')
+            self.timer.end()
+
+    # Which strands are different from what was last sent (just [0] if any
+    # of it is and they all go together).  A numpy compare of the whole frame,
+    # it's only a few KB.
+    def changed(self):
+        numpy.not_equal(self.writer.frame, self.last_sent, out=self._diff)
+        if self.writer.strand_length:
+            return numpy.flatnonzero(self._diff.reshape(self.writer.strand_count, -1).any(axis=1))
+        return [0] if self._diff.any() else []
+
+
+# Drives several OPC servers (FadeCandys) at once, one connection and one
+# OutputThread each.  Every controller gets its own slice of the frame (see
+# "controllers" in layout.json) so a controller that is slow, or gone
+# altogether, only holds up its own thread.  The animation still only
+# calls publish() and never waits.
+class FanOut:
+    # controllers are geometry.Controller tuples.  Any without an address
+    # go to default_address.
+    def __init__(self, controllers, default_address, fps, dithering=True, keepalive=KEEPALIVE_TIME,
+                 verbose=False):
+        self.controllers = list(controllers)
+        self.writers = []
+        self.threads = []
+        for controller in self.controllers:
+            writer = OpcWriter(controller.address or default_address, controller.end - controller.start,
+                               channel=controller.channel, verbose=verbose,
+                               strand_length=controller.strand_length)
+            self.writers.append(writer)
+            self.threads.append(OutputThread(writer, fps, dithering, name=f'led-output-{controller.name}',
+                                             keepalive=keepalive))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self.threads:
+            thread.stop()
+
+    def publish(self, frame):
+        for controller, thread in zip(self.controllers, self.threads):
+            thread.publish(frame[controller.start:controller.end])
+
+    # Sends straight away, without the threads (which have to be stopped).
+    # Used for the fade out when quitting and for replays.
+    def put_pixels(self, frame):
+        for controller, writer in zip(self.controllers, self.writers):
+            writer.put_pixels(frame[controller.start:controller.end])
+
+    # One line per controller: up or down, frames sent and dropped, failed
+    # connects and sends and how long the sends are taking.
+    def report(self):
+        lines = []
+        for controller, writer, thread in zip(self.controllers, self.writers, self.threads):
+            state = 'up' if writer.connected else 'DOWN'
+            line = (f"{controller.name} {writer.host}:{writer.port}/{writer.channel} {state}: "
+                    f"{thread.sent} sent, {thread.skipped} unchanged, {thread.dropped} dropped, "
+                    f"{writer.failures} failed")
+            send = thread.timer.stats().get('send')
+            if send:
+                line += f", send {send[0]:0.2f} avg {send[1]:0.2f} p99 (ms)"
+            lines.append(line)
+        return lines
@@ -0,0 +1,64 @@
+import numpy
+
+from color import LED_CURRENT
+
+# Even a dark LED draws a little (mA)
+IDLE_CURRENT = 1.0
+
+# The LED supply voltage (the 5V regulator, not the battery)
+LED_VOLTAGE = 5.0
+
+# How quickly the limiter reacts (seconds).  Back off quickly when we go over
+# budget but come back up slowly so it doesn't pump.
+ATTACK_TIME = 0.1
+RELEASE_TIME = 2.0
+
+# Time constant (seconds) for the rolling average power
+POWER_WINDOW = 60.0
+
+# Estimates how much current the LEDs are pulling from what is actually being
+# sent to them and, if there's a budget, works out how far to turn the output
+# down to stay inside it.  The estimate is just the sum of the channel values
+# (each channel at 255 is a third of LED_CURRENT) plus the idle current.
+class PowerMonitor:
+    def __init__(self, strand_sizes, strand_length, budget=None):
+        self.strand_sizes = numpy.asarray(strand_sizes)
+        self.strand_length = strand_length
+        self.budget = budget
+
+        self.scale = 1.0
+        self.strand_current = numpy.zeros(len(self.strand_sizes))
+        self.current = 0.0
+        self.power = 0.0        # Rolling average (W)
+        self.energy = 0.0       # Since startup (Wh)
+        self.peak = 0.0
+        self.frames = 0
+
+    # Takes the frame as sent (with the current scale already applied) and
+    # returns the scale to use from now on.
+    def update(self, frame, dt):
+        sums = frame.reshape(len(self.strand_sizes), -1).sum(axis=1)
+        self.strand_current = sums * (LED_CURRENT / (3 * 255)) + self.strand_sizes * IDLE_CURRENT
+        self.current = self.strand_current.sum()
+        self.peak = max(self.peak, self.current)
+
+        watts = self.current / 1000 * LED_VOLTAGE
+        self.energy += watts * dt / 3600
+        self.power += (watts - self.power) * (min(1.0, dt / POWER_WINDOW) if self.frames else 1.0)
+        self.frames += 1
+
+        if self.budget:
+            # What it would have been without the limiter
+            idle = self.strand_sizes.sum() * IDLE_CURRENT
+            unlimited = (self.current - idle) / self.scale + idle
+            target = min(1.0, max(0.0, self.budget - idle) / max(unlimited - idle, 1e-3))
+            tau = ATTACK_TIME if target < self.scale else RELEASE_TIME
+            self.scale += (target - self.scale) * min(1.0, dt / tau)
+            self.scale = max(0.01, self.scale)
+
+        return self.scale
+
+    def report(self):
+        limit = f", limit {self.scale:0.0%}" if self.scale < 1.0 else ""
+        return (f"{self.current:0.0f} mA, peak {self.peak:0.0f} mA, "
+                f"{self.power:0.1f} W, {self.energy:0.2f} Wh{limit}")
@@ -0,0 +1,155 @@
+import struct
+
+import numpy
+
+# Recorded shows are a 16 byte header followed by one record per frame.
+#
+#   'raw': Every record is a float64 timestamp (seconds from the start)
+#          followed by the whole frame.  Fixed size records so the whole file
+#          can be memory mapped as one numpy array and played back as is.
+#   'rle': Every record is a timestamp, a uint32 payload length and then the
+#          frame XORed with the one before it, run length encoded as
+#          (count, value) byte pairs.  Static frames come out at a few bytes.
+#          Every KEY_INTERVAL'th frame is XORed with black instead so there's
+#          somewhere to start from when seeking.
+MAGIC = b'PSHW'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')   # magic, version, format, pixels, key interval
+RLE_RECORD = struct.Struct('<dI')   # time, payload length
+
+FORMATS = ('raw', 'rle')
+KEY_INTERVAL = 256
+
+# How often (seconds of show) the recording gets flushed to disk.  On the
+# boat the Pi usually just gets unplugged so whatever hasn't been flushed is
+# lost.  Recording drops a partly written last frame.
+FLUSH_TIME = 1.0
+
+def raw_dtype(pixel_count):
+    return numpy.dtype([('time', '<f8'), ('pixels', 'u1', (pixel_count, 3))])
+
+# Run length encoding done with numpy rather than a byte at a time.  Runs
+# longer than 255 get split up.
+def rle_encode(data):
+    starts = numpy.concatenate(([0], numpy.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = numpy.diff(numpy.append(starts, len(data)))
+    chunks = (lengths + 254) // 255
+    counts = numpy.full(chunks.sum(), 255, dtype=numpy.uint8)
+    counts[numpy.cumsum(chunks) - 1] = lengths - (chunks - 1) * 255
+    values = numpy.repeat(data[starts], chunks)
+    return numpy.column_stack((counts, values)).ravel()
+
+def rle_decode(payload):
+    pairs = payload.reshape(-1, 2)
+    return numpy.repeat(pairs[:, 1], pairs[:, 0])
+
+class Recorder:
+    def __init__(self, path, pixel_count, format='raw'):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown recording format {format!r}")
+        self.format = format
+        self.pixel_count = pixel_count
+        self.frames = 0
+
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, FORMATS.index(format), pixel_count, KEY_INTERVAL))
+        self._record = numpy.zeros(1, dtype=raw_dtype(pixel_count))
+        self._last = numpy.zeros(pixel_count * 3, dtype=numpy.uint8)
+        self._flushed = 0.0
+
+    def write(self, frame, t):
+        if self.format == 'raw':
+            self._record['time'] = t
+            self._record['pixels'] = frame
+            self.file.write(self._record.tobytes())
+        else:
+            frame = numpy.asarray(frame, dtype=numpy.uint8).ravel()
+            if self.frames % KEY_INTERVAL == 0:
+                self._last[:] = 0
+            payload = rle_encode(frame ^ self._last)
+            self.file.write(RLE_RECORD.pack(t, len(payload)))
+            self.file.write(payload.tobytes())
+            self._last[:] = frame
+        self.frames += 1
+
+        if t - self._flushed >= FLUSH_TIME:
+            self.file.flush()
+            self._flushed = t
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# A recorded show, memory mapped.  Iterating gives (time, frame) pairs.  For
+# raw recordings the frames are views straight into the file; RLE ones get
+# decoded into the same buffer every time so copy them if you need to keep
+# them.
+class Recording:
+    def __init__(self, path):
+        self.data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        magic, version, format, pixel_count, key_interval = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a recording")
+        self.format = FORMATS[format]
+        self.pixel_count = pixel_count
+        self.key_interval = key_interval
+        self.frame = numpy.zeros((pixel_count, 3), dtype=numpy.uint8)
+
+        body = self.data[HEADER.size:]
+        if self.format == 'raw':
+            dtype = raw_dtype(pixel_count)
+            self.records = body[:len(body) - len(body) % dtype.itemsize].view(dtype)
+            self.times = self.records['time']
+        else:
+            # Find where each record starts.  Only the small record headers
+            # get read here, the payloads are left alone until needed.  A
+            # last record that didn't get written out in full is dropped.
+            offsets = []
+            times = []
+            offset = HEADER.size
+            while offset + RLE_RECORD.size <= len(self.data):
+                t, length = RLE_RECORD.unpack_from(self.data, offset)
+                if offset + RLE_RECORD.size + length > len(self.data):
+                    break
+                offsets.append(offset + RLE_RECORD.size)
+                times.append(t)
+                offset += RLE_RECORD.size + length
+            self.offsets = numpy.array(offsets + [offset + RLE_RECORD.size])
+            self.times = numpy.array(times)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self) else 0.0
+
+    def _apply(self, ix):
+        start = self.offsets[ix]
+        end = self.offsets[ix + 1] - RLE_RECORD.size
+        delta = rle_decode(self.data[start:end]).reshape(self.frame.shape)
+        if ix % self.key_interval == 0:
+            self.frame[:] = delta
+        else:
+            self.frame ^= delta
+
+    def __getitem__(self, ix):
+        if self.format == 'raw':
+            return self.records['pixels'][ix]
+
+        for key in range(ix - ix % self.key_interval, ix + 1):
+            self._apply(key)
+        return self.frame
+
+    def __iter__(self):
+        for ix, t in enumerate(self.times):
+            if self.format == 'raw':
+                yield t, self.records['pixels'][ix]
+            else:
+                self._apply(ix)
+                yield t, self.frame
@@ -0,0 +1,201 @@
+import os
+import sys
+import heapq
+import itertools
+import threading
+
+import pygame
+
+from cache import cached_bytes
+
+# Decoding the MP3s is what used to keep the ship dark at startup.  The
+# decoded PCM gets cached (see cache.py) in whatever format the mixer is
+# running at, so after the first run it's just a memory map.  The cache is
+# keyed on the file's size and mtime as well as the mixer settings so
+# changing either gets it decoded again.
+#
+# Everything is loaded on a background thread.  Asking for a sound that
+# isn't ready yet gets you silence.
+
+# How far the background music gets turned down while a ducking channel
+# is playing
+DUCK_VOLUME = 0.3
+
+# Every file in a (possibly nested) dict/list of them
+def sound_files(tree):
+    if isinstance(tree, dict):
+        tree = tree.values()
+    elif isinstance(tree, str):
+        yield tree
+        return
+    for branch in tree:
+        yield from sound_files(branch)
+
+def decode(path):
+    return pygame.mixer.Sound(path).get_raw()
+
+class SoundBank:
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.mixer = pygame.mixer.get_init()
+        self.sounds = dict()
+        self.failed = set()
+        self.silence = pygame.mixer.Sound(buffer=bytes(4))
+        self.thread = None
+
+    def load(self, path):
+        stat = os.stat(path)
+        key = dict(path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns, mixer=self.mixer)
+        pcm = cached_bytes('sfx', key, lambda: decode(path), ext='.pcm')
+        sound = pygame.mixer.Sound(buffer=pcm)
+        self.sounds[path] = sound
+        return sound
+
+    def preload(self, paths):
+        paths = list(paths)
+
+        def run():
+            for path in paths:
+                if path in self.sounds:
+                    continue
+                try:
+                    self.load(path)
+                except (OSError, pygame.error) as e:
+                    self.failed.add(path)
+                    print(f"Can't load {path}: {e}", file=sys.stderr, flush=True)
+            if self.verbose:
+                print(f"Loaded {len(self.sounds)} sounds", file=sys.stderr, flush=True)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    @property
+    def ready(self):
+        return self.thread is None or not self.thread.is_alive()
+
+    def __getitem__(self, path):
+        sound = self.sounds.get(path)
+        if sound is None:
+            if path not in self.failed:
+                print(f"{path} isn't loaded yet", file=sys.stderr, flush=True)
+            return self.silence
+        return sound
+
+class Cue:
+    def __init__(self, sound, priority=0, loops=0, fade_in=0):
+        self.sound = sound
+        self.priority = priority
+        self.loops = loops
+        self.fade_in = fade_in
+
+# Plays the sound effects.  Each named channel has a queue and the next
+# sound starts when the mixer says the last one has finished (channel end
+# events), so nothing has to be checked every frame.  Pass the events to
+# handle().
+#
+# A sound with a higher priority than the one playing (or played with
+# interrupt=True) cuts in, cross-fading over crossfade ms.  Anything else
+# waits its turn, highest priority first and then first come first served.
+# Every channel gets a second mixer channel so the two sounds really do
+# overlap while cross-fading.
+#
+# While any of the ducking channels are playing, the background music is
+# turned down.  It goes back to where it was when they are done.
+class SoundScheduler:
+    def __init__(self, channels, ducking=(), duck_volume=DUCK_VOLUME):
+        count = max(channels.values()) + 1
+        if pygame.mixer.get_num_channels() < count * 2:
+            pygame.mixer.set_num_channels(count * 2)
+
+        self.voices = dict()
+        self.events = dict()
+        for name, ix in channels.items():
+            self.voices[name] = (pygame.mixer.Channel(ix), pygame.mixer.Channel(ix + count))
+            for voice, channel in enumerate(self.voices[name]):
+                event = pygame.event.custom_type()
+                channel.set_endevent(event)
+                self.events[event] = (name, voice)
+
+        self.active = {name: 0 for name in channels}
+        self.playing = {name: None for name in channels}
+        self.queues = {name: [] for name in channels}
+        self._order = itertools.count()
+
+        self.ducking = set(ducking)
+        self.duck_volume = duck_volume
+        self.restore_volume = None
+
+    def channel(self, name):
+        return self.voices[name][self.active[name]]
+
+    def idle(self, name):
+        return self.playing[name] is None
+
+    # Plays sound on the channel now if it's free (or this is more important
+    # than what's playing), otherwise queues it.  interrupt cuts in whatever
+    # is playing and throws the queue away too, so what was waiting doesn't
+    # turn up later (the warp sounds rely on this to keep track).
+    def play(self, name, sound, priority=0, loops=0, crossfade=0, interrupt=False):
+        cue = Cue(sound, priority, loops)
+        current = self.playing[name]
+        if interrupt:
+            self.queues[name].clear()
+        if current is None:
+            self._start(name, cue)
+        elif interrupt or priority > current.priority:
+            if crossfade:
+                self.channel(name).fadeout(crossfade)
+            else:
+                self.channel(name).stop()
+            self.active[name] ^= 1
+            cue.fade_in = crossfade
+            self._start(name, cue)
+        else:
+            heapq.heappush(self.queues[name], (-priority, next(self._order), cue))
+
+    # Stops the channel (fading out over fade ms) and throws away its queue
+    def stop(self, name, fade=0):
+        self.queues[name].clear()
+        self.playing[name] = None
+        if fade:
+            self.channel(name).fadeout(fade)
+        else:
+            self.channel(name).stop()
+        self.duck()
+
+    # Returns True if the event was one of ours
+    def handle(self, event):
+        if event.type not in self.events:
+            return False
+
+        # End events for the channel we cross-faded away from (or that got
+        # cut off by a newer sound) don't count.
+        name, voice = self.events[event.type]
+        channel = self.voices[name][voice]
+        if voice == self.active[name] and self.playing[name] is not None and not channel.get_busy():
+            self.next(name)
+        return True
+
+    def next(self, name):
+        if self.queues[name]:
+            _, _, cue = heapq.heappop(self.queues[name])
+            self._start(name, cue)
+        else:
+            self.playing[name] = None
+            self.duck()
+
+    def _start(self, name, cue):
+        self.channel(name).play(cue.sound, loops=cue.loops, fade_ms=cue.fade_in)
+        self.playing[name] = cue
+        self.duck()
+
+    def duck(self):
+        busy = any(self.playing[name] is not None for name in self.ducking)
+        if busy and self.restore_volume is None:
+            print("Ducking background")
+            self.restore_volume = pygame.mixer.music.get_volume()
+            pygame.mixer.music.set_volume(self.duck_volume)
+        elif not busy and self.restore_volume is not None:
+            print("Restore background")
+            pygame.mixer.music.set_volume(self.restore_volume)
+            self.restore_volume = None
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy
+
+import boat
+
+# Frames to watch during each fade
+FRAMES = 50
+
+# While cross-fading both the new mode and the old one get drawn every frame.
+# Each has to move its own waves and Larson scanner along one step per
+# update(), not the other one's as well (they used to share them, which ran
+# both at double speed for the whole fade).
+#
+#   python -m unittest test_fade
+class TestFade(unittest.TestCase):
+    def fade(self, old, new):
+        ship = boat.Boat(seed=1, transition_time=1e9)    # Never finishes
+        ship.mode = old
+        for _ in range(5):
+            ship.update(20)
+        ship.mode = new
+        self.assertIsNotNone(ship.fading)
+        return ship
+
+    def assert_steps_once(self, ship):
+        drawn = (ship.effect, ship.fading)
+        for _ in range(FRAMES):
+            before = [(effect.wave_offset, effect.kitt_pos) for effect in drawn]
+            ship.update(20)
+            for effect, (wave, kitt) in zip(drawn, before):
+                step = (effect.wave_offset - wave) % (2 * numpy.pi)
+                self.assertTrue(numpy.isclose(step, 0) or numpy.isclose(step, boat.WAVE_STEP),
+                                f"{type(effect).__name__} waves moved {step:0.2f}")
+                self.assertLessEqual(abs(effect.kitt_pos - kitt), 1,
+                                     f"{type(effect).__name__} scanner moved {effect.kitt_pos - kitt}")
+
+    def test_boat_to_space(self):
+        self.assert_steps_once(self.fade('boat', 'space'))
+
+    def test_boat_to_america(self):
+        self.assert_steps_once(self.fade('boat', 'america'))
+
+    # Same effect at another speed, nothing new to fade (the fade in from
+    # the default mode just carries on)
+    def test_boat_to_fast_boat(self):
+        ship = boat.Boat(seed=1, transition_time=1e9)
+        ship.mode = 'boat'
+        fading = ship.fading
+        ship.mode = 'fast_boat'
+        self.assertIs(ship.fading, fading)
+
+if __name__ == '__main__':
+    unittest.main()
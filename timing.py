@@ -0,0 +1,126 @@
+import time
+import collections
+
+import numpy
+
+# How far behind (in frames) we let ourselves fall before giving up on the
+# missed frames and skipping ahead.  Anything less than this and we just run
+# the next frames back to back to catch up.
+MAX_LAG_FRAMES = 3
+
+# Number of recent frame periods kept around for the stats.
+STATS_WINDOW = 256
+
+# Fixed timestep frame scheduler.  Deadlines are on a monotonic clock and
+# advance by exactly one period each frame, so time spent rendering and
+# sending doesn't pile up on top of the sleep like pygame.time.wait() did.
+class FrameClock:
+    def __init__(self, fps, max_lag=MAX_LAG_FRAMES, clock=time.perf_counter, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.max_lag = max_lag
+
+        self.last = self.clock()
+        self.deadline = self.last
+        self.periods = collections.deque(maxlen=STATS_WINDOW)
+        self.frames = 0
+        self.skipped = 0
+        self.fps = fps
+
+    @property
+    def fps(self):
+        return self._fps
+
+    # Changing the rate restarts the schedule from the last frame so we don't
+    # try to catch up on frames from the old rate.
+    @fps.setter
+    def fps(self, value):
+        self._fps = value
+        self.period = 1.0 / value
+        self.deadline = self.last + self.period
+        self.periods.clear()
+        self.skipped = 0
+
+    # Waits for the next frame and returns the real time since the last one
+    # in ms, same as pygame.time.wait() used to.
+    def tick(self):
+        now = self.clock()
+        late = now - self.deadline
+        if late < 0:
+            self.sleep(-late)
+            now = self.clock()
+        elif late > self.max_lag * self.period:
+            # Too far behind.  Drop the frames we missed but stay in phase.
+            missed = int(late / self.period)
+            self.skipped += missed
+            self.deadline += missed * self.period
+        self.deadline += self.period
+
+        dt = now - self.last
+        self.last = now
+        self.periods.append(dt)
+        self.frames += 1
+        return dt * 1000
+
+    @property
+    def achieved_fps(self):
+        if not self.periods:
+            return 0.0
+        return 1.0 / numpy.mean(self.periods)
+
+    # Standard deviation of the frame period in ms
+    @property
+    def jitter(self):
+        if len(self.periods) < 2:
+            return 0.0
+        return numpy.std(self.periods) * 1000
+
+    def report(self):
+        return (f"{self.achieved_fps:0.1f}/{self.fps} fps, "
+                f"jitter {self.jitter:0.2f} ms, {self.skipped} skipped")
+
+# Number of frames the StageTimer remembers
+TIMER_FRAMES = 512
+
+# Keeps how long each stage of the last few hundred frames took in a ring
+# buffer.  Cheap enough to leave running all the time: a clock read and an
+# add per stage.  Call start() at the top of the frame, mark() at the end of
+# each stage and end() when the frame's done.
+class StageTimer:
+    def __init__(self, stages, size=TIMER_FRAMES):
+        self.stages = tuple(stages)
+        self.index = {stage: ix for ix, stage in enumerate(self.stages)}
+        self.times = numpy.zeros((size, len(self.stages)))
+        self.frames = 0
+        self._row = self.times[0]
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._row = self.times[self.frames % len(self.times)]
+        self._row[:] = 0
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self._row[self.index[stage]] += now - self._last
+        self._last = now
+
+    def end(self):
+        self.frames += 1
+
+    # (mean, p99, max) in ms for each stage (and the total) over the frames
+    # we still have.
+    def stats(self):
+        count = min(self.frames, len(self.times))
+        if not count:
+            return dict()
+
+        times = self.times[:count] * 1000
+        stats = dict()
+        for stage, column in zip(self.stages + ('total',), (*times.T, times.sum(axis=1))):
+            stats[stage] = (column.mean(), numpy.percentile(column, 99), column.max())
+        return stats
+
+    def report(self):
+        return [f"{stage:>8}: {mean:6.2f} avg {p99:6.2f} p99 {peak:6.2f} max (ms)"
+                for stage, (mean, p99, peak) in self.stats().items()]